@@ -2,40 +2,108 @@
 
 from __future__ import print_function
 
-import time
+import argparse
+import importlib
+from typing import Callable, Optional
 
-from bot import ChatBot
 from config import Config
-from lang import Lang
-from logger import Logger
-from player import Player
+from control import ControlServer
+from tracing import StartupTracer, profiled, traced
+
+_DEFAULT_TRACE = "./startup-trace.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Minecraft chat bot for multiple accounts")
+    parser.add_argument("--build-lang-snapshot", nargs="*", metavar="LANG",
+                        help="prebuild language snapshots (default: the language in config.json) and exit")
+    parser.add_argument("--capture", metavar="FILE",
+                        help="record chat, health, disconnect and join packets to FILE for capture.py replays")
+    parser.add_argument("--profile-startup", nargs="?", const=_DEFAULT_TRACE, metavar="FILE",
+                        help="time each startup phase and account, log a summary and write a Chrome trace "
+                             "to FILE (default: {0})".format(_DEFAULT_TRACE))
+    parser.add_argument("--startup-cprofile", metavar="FILE",
+                        help="also run startup under cProfile and write its stats to FILE; implies "
+                             "--profile-startup")
+    args = parser.parse_args()
+    if args.startup_cprofile is not None and args.profile_startup is None:
+        args.profile_startup = _DEFAULT_TRACE
+    return args
+
+
+def build_lang_snapshots(langs):
+    from lang import LangRegistry
+
+    locales = LangRegistry()
+    for lang_name in langs:
+        locales.get(lang_name)
+
+
+def start_control(config: Config, handle_text: Callable[[str], None]):
+    ControlServer(
+        handle_text,
+        unix_path=config.control["unix_socket"],
+        host=config.control["host"],
+        port=int(config.control["port"]) if config.control["tcp_enabled"] else None
+    )
+
+
+def start(args, tracer: Optional[StartupTracer]) -> Optional[Callable[[], None]]:
+    """Import and start everything, returning the console loop to run, or None when there is nothing to run."""
+    # Imported here rather than at the top so --profile-startup can time them
+    with traced(tracer, "import colorama"):
+        importlib.import_module("colorama")
+    with traced(tracer, "import pyCraft"):
+        importlib.import_module("minecraft.networking.connection")
+    with traced(tracer, "import modules"):
+        from bot import ChatBot
+        from lang import LangRegistry
+        from logger import Logger
+        from shard import ShardManager
+        from startup import start_fleet
+
+    with traced(tracer, "logger"):
+        Logger()
+    if args.build_lang_snapshot is not None:
+        build_lang_snapshots(args.build_lang_snapshot or [Config().lang])
+        return None
+    with traced(tracer, "config"):
+        config = Config()
+    with traced(tracer, "lang"):
+        locales = LangRegistry()
+        lang = locales.get(config.lang)
+    if int(config.sharding["workers"]) > 1:
+        with traced(tracer, "shards"):
+            shards = ShardManager(
+                config,
+                lang,
+                int(config.sharding["workers"]),
+                capture_path=args.capture,
+                trace_path=args.profile_startup,
+                profile_path=args.startup_cprofile
+            )
+            shards.start()
+            start_control(config, shards.handle_text)
+        return shards.start_listening
+    fleet = start_fleet(config, lang, capture_path=args.capture, locales=locales, tracer=tracer)
+
+    with traced(tracer, "console"):
+        bot = ChatBot(fleet.players, lang, fleet.archive, fleet.reloader, fleet.jobs, fleet.sinks)
+        start_control(config, bot.handle_text)
+    return bot.start_listening
 
 
 def main():
-    logger = Logger()
-    config = Config()
-    lang = Lang(config.lang)
-    players = []
-
-    for account in config.accounts:
-        if account["disabled"]:
-            logger.logger.info(lang.lang("main.auth.disabled").format(email=account["email"]))
-            continue
-        player = Player(
-            account=account["email"],
-            password=account["password"],
-            server_address=config.server["ip"],
-            port=config.server["port"],
-            version=498,
-            auto_reconnect=config.auto_reconnect,
-            auto_respawn=config.auto_respawn,
-            lang=lang
-        )
-        players.append(player)
-        time.sleep(1)
-
-    bot = ChatBot(players, lang)
-    bot.start_listening()
+    args = parse_args()
+    tracer = None
+    if args.profile_startup is not None:
+        tracer = StartupTracer(profile=args.startup_cprofile is not None)
+    with profiled(tracer):
+        listen = start(args, tracer)
+    if tracer is not None:
+        tracer.report_when_joined(args.profile_startup, args.startup_cprofile)
+    if listen is not None:
+        listen()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(value: str, now: Optional[float] = None) -> float:
+    """Parse a relative duration ago (90m, 2h, 3d) or a local YYYY-mm-dd[THH:MM[:SS]] into a timestamp."""
+    match = _DURATION.match(value)
+    if match is not None:
+        return (now if now is not None else time.time()) - float(match.group(1)) * _UNITS[match.group(2)]
+    for pattern in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, pattern))
+        except ValueError:
+            continue
+    raise ValueError("Invalid time: '{0}'".format(value))
+
+
+class ChatArchive:
+    """
+    Structured chat history in gzip segments of JSON lines, rotated by size and age. Every segment has
+    a small index (time range, count and bots) so searches only decompress segments that can match.
+    The open segment is flushed every second or 1000 records, busy or not, and closed at exit.
+    """
+
+    __flush_seconds = 1.0
+    __flush_records = 1000
+    __close_timeout = 10.0
+
+    def __init__(self, folder: str = "./archive", segment_records: int = 10000, segment_seconds: float = 3600,
+                 capacity: int = 10000):
+        self.__logger = logging.getLogger("Archive")
+        logging.basicConfig(level=logging.INFO)
+        self.__folder = folder
+        self.__segment_records = segment_records
+        self.__segment_seconds = segment_seconds
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+        self.__queue = queue.Queue(capacity)
+        self.__lock = threading.Lock()
+        self.__segment = None
+        self.__index = None
+        self.__dirty = False
+        self.__unflushed = 0
+        self.__flushed = time.monotonic()
+        self.__opened = 0.0
+        self.__closing = threading.Event()
+        self.dropped = 0
+        self.__thread = threading.Thread(target=self.__run, name="Archive", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def record(self, timestamp: float, bots: List[str], position: str, json_data: str, text: str):
+        try:
+            self.__queue.put_nowait((timestamp, bots, position, json_data, text))
+        except queue.Full:
+            self.dropped += 1
+
+    def __open_segment(self, timestamp: float):
+        # The pid keeps segments apart when several worker processes share the folder
+        prefix = "chat-{0}-{1}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp)), os.getpid())
+        name = prefix
+        suffix = 0
+        while os.path.exists(os.path.join(self.__folder, name + ".jsonl.gz")):
+            suffix += 1
+            name = "{0}-{1}".format(prefix, suffix)
+        self.__segment = gzip.open(os.path.join(self.__folder, name + ".jsonl.gz"), "wt", encoding="utf-8")
+        self.__index = {
+            "segment": name + ".jsonl.gz",
+            "start": timestamp,
+            "end": timestamp,
+            "count": 0,
+            "bots": []
+        }
+        self.__opened = time.monotonic()
+
+    def __write_index(self):
+        path = os.path.join(self.__folder, self.__index["segment"].replace(".jsonl.gz", ".idx.json"))
+        with open(path + ".tmp", "w") as fs:
+            json.dump(self.__index, fs)
+        os.replace(path + ".tmp", path)
+
+    def __close_segment(self):
+        self.__segment.close()
+        self.__write_index()
+        self.__segment = None
+        self.__index = None
+        self.__dirty = False
+
+    def __write(self, entry: tuple):
+        timestamp, bots, position, json_data, text = entry
+        if self.__segment is not None and (self.__index["count"] >= self.__segment_records
+                                           or time.monotonic() - self.__opened >= self.__segment_seconds):
+            self.__close_segment()
+        if self.__segment is None:
+            self.__open_segment(timestamp)
+        self.__segment.write(json.dumps({
+            "time": timestamp,
+            "bots": bots,
+            "position": position,
+            "json": json_data,
+            "text": text
+        }, ensure_ascii=False) + "\n")
+        index = self.__index
+        index["start"] = min(index["start"], timestamp)
+        index["end"] = max(index["end"], timestamp)
+        index["count"] += 1
+        for bot in bots:
+            if bot not in index["bots"]:
+                index["bots"].append(bot)
+        self.__dirty = True
+        self.__unflushed += 1
+
+    def __flush(self):
+        if self.__segment is not None and self.__dirty:
+            self.__segment.flush()
+            self.__write_index()
+            self.__dirty = False
+        self.__unflushed = 0
+        self.__flushed = time.monotonic()
+
+    def flush(self):
+        """Flush the open segment and rewrite its index, if anything was written since the last flush."""
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        """Write what is still queued and close the open segment, so its gzip stream is complete."""
+        self.__closing.set()
+        try:
+            # Wakes the thread at once instead of after its flush timeout
+            self.__queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.__thread.join(self.__close_timeout)
+
+    def __run(self):
+        while True:
+            try:
+                entry = self.__queue.get(timeout=self.__flush_seconds)
+            except queue.Empty:
+                entry = None
+            closing = self.__closing.is_set()
+            with self.__lock:
+                try:
+                    if entry is not None:
+                        self.__write(entry)
+                    if closing:
+                        while True:
+                            try:
+                                entry = self.__queue.get_nowait()
+                            except queue.Empty:
+                                break
+                            if entry is not None:
+                                self.__write(entry)
+                        if self.__segment is not None:
+                            self.__close_segment()
+                        return
+                    # Under steady chat the queue is never idle, so readers would otherwise never see the open segment
+                    if (self.__unflushed >= self.__flush_records
+                            or time.monotonic() - self.__flushed >= self.__flush_seconds):
+                        self.__flush()
+                except OSError as e:
+                    self.__logger.error("Can't write chat archive: {0}".format(str(e)))
+                    if closing:
+                        return
+
+    def search(self, text: Optional[str] = None, bots: Optional[List[str]] = None, since: Optional[float] = None,
+               until: Optional[float] = None, limit: int = 50) -> List[dict]:
+        self.flush()
+        return search(self.__folder, text, bots, since, until, limit)
+
+
+def _read_segment(path: str):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fs:
+            for line in fs:
+                if line.endswith("\n"):
+                    yield json.loads(line)
+    except EOFError:
+        # The segment being written has no gzip trailer yet
+        return
+
+
+def search(folder: str, text: Optional[str] = None, bots: Optional[List[str]] = None, since: Optional[float] = None,
+           until: Optional[float] = None, limit: int = 50) -> List[dict]:
+    """Return up to limit of the most recent records matching every given filter, oldest first."""
+    indexes = []
+    for file in os.listdir(folder):
+        if not file.endswith(".idx.json"):
+            continue
+        try:
+            with open(os.path.join(folder, file), "r") as fs:
+                indexes.append(json.load(fs))
+        except (OSError, ValueError):
+            continue
+    indexes.sort(key=lambda i: i["start"])
+    needle = text.lower() if text else None
+    results = deque(maxlen=limit)
+    for index in indexes:
+        if since is not None and index["end"] < since:
+            continue
+        if until is not None and index["start"] > until:
+            continue
+        if bots and not set(bots) & set(index["bots"]):
+            continue
+        for record in _read_segment(os.path.join(folder, index["segment"])):
+            if since is not None and record["time"] < since:
+                continue
+            if until is not None and record["time"] > until:
+                continue
+            if bots and not set(bots) & set(record["bots"]):
+                continue
+            if needle is not None and needle not in record["text"].lower():
+                continue
+            results.append(record)
+    return list(results)
+
+
+def format_record(record: dict, text: Optional[str] = None) -> str:
+    return "[{time}][{position}] [{bots}] {text}".format(
+        time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["time"])),
+        position=record["position"],
+        bots=", ".join(record["bots"]),
+        text=record["text"] if text is None else text
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the chat archive")
+    parser.add_argument("text", nargs="?", help="case-insensitive substring of the message")
+    parser.add_argument("--folder", default="./archive", help="archive folder (default: ./archive)")
+    parser.add_argument("--bot", action="append", dest="bots", help="only messages received by this bot, repeatable")
+    parser.add_argument("--since", help="start time, e.g. 2h or 2019-08-01T12:00")
+    parser.add_argument("--until", help="end time, e.g. 30m or 2019-08-01T13:00")
+    parser.add_argument("--limit", type=int, default=50, help="maximum number of results (default: 50)")
+    parser.add_argument("--json", action="store_true", help="print matching records as JSON lines")
+    parser.add_argument("--flavor", choices=["plain", "console", "html", "markdown"], default="plain",
+                        help="re-render messages from their chat JSON (default: the stored plain text)")
+    parser.add_argument("--lang", default="en_us", help="language for --flavor (default: en_us)")
+    args = parser.parse_args()
+    records = search(
+        args.folder,
+        text=args.text,
+        bots=args.bots,
+        since=parse_time(args.since) if args.since else None,
+        until=parse_time(args.until) if args.until else None,
+        limit=args.limit
+    )
+    lang = None
+    if args.flavor != "plain" and not args.json:
+        from lang import Lang
+        lang = Lang(args.lang)
+    for record in records:
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
+        else:
+            print(format_record(record, lang.parse_json_string(record["json"], args.flavor) if lang else None))
+
+
+if __name__ == "__main__":
+    main()
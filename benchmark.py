@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+import player as player_module
+from bot import ChatBot
+from chat import ChatAggregator
+from config import Config
+from lang import Color, Lang
+from player import Player
+from reconnect import ReconnectGate
+from scheduler import Scheduler
+from tokens import TokenStore
+
+_BASELINE = "./benchmark-baseline.json"
+_CHAT_BATCH = 100
+
+# Chat components as 1.14 servers send them: plain chat with hover/click names, join/leave, deaths,
+# whispers, styled broadcasts with nested extra and legacy § codes.
+_PLAYER = {
+    "insertion": "Steve",
+    "clickEvent": {"action": "suggest_command", "value": "/tell Steve "},
+    "hoverEvent": {"action": "show_entity", "value": {"text": "{name:\"Steve\",id:\"0-0-0-0-1\"}"}},
+    "text": "Steve"
+}
+CORPUS = [
+    {"translate": "chat.type.text", "with": [_PLAYER, "hello everyone, anyone up for the nether?"]},
+    {"translate": "chat.type.text", "with": [_PLAYER, "100% sure {this} has braces"]},
+    {"translate": "multiplayer.player.joined", "color": "yellow", "with": [_PLAYER]},
+    {"translate": "multiplayer.player.left", "color": "yellow", "with": [_PLAYER]},
+    {"translate": "death.attack.mob", "with": [_PLAYER, {"translate": "entity.minecraft.zombie"}]},
+    {"translate": "death.attack.player.item", "with": [
+        _PLAYER, {"text": "Alex"}, {"text": "[Sharp Thing]", "italic": True, "color": "aqua"}
+    ]},
+    {"translate": "commands.message.display.incoming", "color": "gray", "italic": True,
+     "with": [_PLAYER, {"text": "meet me at spawn"}]},
+    {"translate": "chat.type.announcement", "with": ["Server", {"text": "", "extra": [
+        {"text": "Restarting in ", "color": "gold"},
+        {"text": "5", "color": "red", "bold": True},
+        {"text": " minutes", "color": "gold", "extra": [{"text": "!", "underlined": True}]}
+    ]}]},
+    {"text": "", "extra": [
+        {"text": "[", "color": "dark_gray"}, {"text": "Lobby", "color": "aqua", "bold": True},
+        {"text": "] ", "color": "dark_gray"}, {"text": "§aWelcome §lback§r to the server", "color": "white"},
+        {"text": " (strike)", "strikethrough": True}
+    ]},
+    {"translate": "chat.type.advancement.task", "with": [
+        _PLAYER, {"translate": "chat.square_brackets", "color": "green", "with": [
+            {"translate": "advancements.story.mine_diamond.title"}
+        ]}
+    ]},
+]
+LEGACY = [
+    "§6[Server] §eRestarting in §c5 §eminutes",
+    "§a§lWelcome back, §r§bSteve§r!",
+    "plain text without any formatting codes at all"
+]
+
+
+class FakeAuthenticationToken:
+    def __init__(self, username=None, access_token=None, client_token=None):
+        self.username = username
+        self.access_token = access_token or "access"
+        self.client_token = client_token or "client"
+        self.authenticated = False
+        self.profile = None
+
+    def refresh(self):
+        self.authenticated = True
+        self.profile = type("Profile", (), {"name": self.username.split("@")[0]})()
+        return True
+
+    def authenticate(self, username, password):
+        return self.refresh()
+
+
+class FakeConnection:
+    """In-memory stand-in for minecraft.networking.connection.Connection that only counts packets."""
+
+    def __init__(self, address, port, initial_version=None, auth_token=None, **kwargs):
+        self.options = type("Options", (), {"address": address, "port": port})()
+        self.connected = False
+        self.written = 0
+        self.file_object = None
+        self.reactor = None
+
+    def register_packet_listener(self, *args, **kwargs):
+        pass
+
+    def register_exception_handler(self, *args, **kwargs):
+        pass
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self, immediate=False):
+        self.connected = False
+
+    def write_packet(self, packet, force=False):
+        self.written += 1
+
+
+class Benchmark:
+    def __init__(self, repeat: int, min_time: float):
+        self.__repeat = repeat
+        self.__min_time = min_time
+        self.results = {}
+
+    def run(self, name: str, func: Callable[[], None], ops_per_call: int = 1):
+        # Calibrate the loop count so one round takes at least min_time, then keep the fastest round
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.__min_time or loops >= 1 << 20:
+                break
+            loops *= 2
+        best = elapsed
+        for _ in range(self.__repeat - 1):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            best = min(best, time.perf_counter() - start)
+        self.results[name] = {
+            "ns_per_op": best / (loops * ops_per_call) * 1e9,
+            "ops": loops * ops_per_call
+        }
+        print("{0:<32} {1:>14.0f} ns/op".format(name, self.results[name]["ns_per_op"]), file=sys.stderr)
+
+
+def make_players(usernames: List[str], lang: Lang, data_folder: str) -> List[Player]:
+    player_module.authentication.AuthenticationToken = FakeAuthenticationToken
+    player_module.Connection = FakeConnection
+    config = Config(testing=True)
+    scheduler = Scheduler()
+    aggregator = ChatAggregator(lang, 0)
+    # One store for the fleet, as in the app; each store has its own writer thread and exit hook
+    token_store = TokenStore(os.path.join(data_folder, "data.json"))
+    outbound = dict(config.outbound, queue_size=1 << 20, messages_per_second=0)
+    return [Player(
+        account="{0}@example.com".format(username),
+        password="",
+        server_address="localhost",
+        port=25565,
+        version=498,
+        auto_reconnect=False,
+        auto_respawn=False,
+        lang=lang,
+        token_store=token_store,
+        outbound=outbound,
+        scheduler=scheduler,
+        reconnect_gate=ReconnectGate("localhost", 25565, config.reconnect, scheduler),
+        chat_aggregator=aggregator
+    ) for username in usernames]
+
+
+def chat_through_send(player: Player):
+    # chat only queues the message, so wait for the sender thread to write the whole batch
+    queue = player.chat_queue
+    target = queue.sent + _CHAT_BATCH
+    for _ in range(_CHAT_BATCH):
+        player.chat("hello")
+    while queue.sent < target:
+        time.sleep(0)
+
+
+def run_benchmarks(repeat: int, min_time: float, players: int) -> dict:
+    bench = Benchmark(repeat, min_time)
+
+    bench.run("lang.startup.json", lambda: Lang("en_us", snapshot=False))
+    Lang("en_us")
+    bench.run("lang.startup.snapshot", lambda: Lang("en_us"))
+
+    lang = Lang("en_us")
+    raw_corpus = [json.dumps(component) for component in CORPUS]
+
+    def parse_corpus():
+        for component in CORPUS:
+            lang.parse_json(component)
+
+    def parse_corpus_cached():
+        for raw in raw_corpus:
+            lang.parse_json_string(raw)
+
+    bench.run("lang.parse_json", parse_corpus, len(CORPUS))
+    bench.run("lang.parse_json_string.cached", parse_corpus_cached, len(raw_corpus))
+
+    color = Color()
+
+    def format_legacy():
+        for text in LEGACY:
+            color.format_color(text)
+
+    bench.run("color.format_color", format_legacy, len(LEGACY))
+
+    with tempfile.TemporaryDirectory() as data_folder:
+        fleet = make_players(["bot{0}".format(i) for i in range(players)], lang, data_folder)
+        bot = ChatBot(fleet, lang)
+        commands = [
+            "~toggle_respawn {0}".format(fleet[-1].username),
+            "~chat {0} hello".format(fleet[0].username),
+            "~unknown_command",
+            "~queue {0}".format(fleet[len(fleet) // 2].username)
+        ]
+
+        def dispatch():
+            for command in commands:
+                bot.handle_text(command)
+
+        bench.run("bot.handle_text.dispatch", dispatch, len(commands))
+        bench.run("bot.handle_text.broadcast.{0}".format(players), lambda: bot.handle_text("hello fleet"))
+        bench.run("player.chat.sent", lambda: chat_through_send(fleet[0]), _CHAT_BATCH)
+    return bench.results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]["ns_per_op"]
+        change = result["ns_per_op"] / before - 1 if before > 0 else 0.0
+        print("{0:<32} {1:>+8.1%}".format(name, change), file=sys.stderr)
+        if change > threshold:
+            regressions.append("{0}: {1:.0f} -> {2:.0f} ns/op ({3:+.1%})".format(
+                name, before, result["ns_per_op"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline microbenchmarks for chat rendering, dispatch and fan-out",
+        epilog="Baselines are only comparable on the machine that wrote them: run once with --save-baseline, "
+               "then with --baseline after a change to fail on regressions.")
+    parser.add_argument("--output", help="write results as JSON to this file (default: stdout)")
+    parser.add_argument("--save-baseline", nargs="?", const=_BASELINE, metavar="FILE",
+                        help="also store the results as the baseline for later --baseline runs "
+                             "(default: {0})".format(_BASELINE))
+    parser.add_argument("--baseline", nargs="?", const=_BASELINE, metavar="FILE",
+                        help="compare against a baseline stored with --save-baseline, or results written with "
+                             "--output (default: {0})".format(_BASELINE))
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fail when a benchmark is slower than the baseline by more than this ratio (default: 0.2)")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per benchmark, the fastest is kept (default: 5)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round (default: 0.2)")
+    parser.add_argument("--players", type=int, default=50, help="fake players for fan-out (default: 50)")
+    args = parser.parse_args()
+    # Paths are relative to where the benchmark was started, not the folder it switches to below
+    output, save_baseline, baseline_path = (os.path.abspath(path) if path else None
+                                            for path in (args.output, args.save_baseline, args.baseline))
+    if baseline_path and not os.path.isfile(baseline_path):
+        parser.error("no baseline at {0}, store one first with --save-baseline".format(baseline_path))
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    logging.disable(logging.CRITICAL)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "results": run_benchmarks(args.repeat, args.min_time, args.players)
+    }
+    if output:
+        with open(output, "w") as fs:
+            json.dump(report, fs, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if baseline_path:
+        with open(baseline_path, "r") as fs:
+            baseline = json.load(fs)["results"]
+        regressions = compare(report["results"], baseline, args.threshold)
+        if len(regressions) > 0:
+            print("Regressions over {0:.0%}:".format(args.threshold), file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            exit(1)
+    # Saved after the comparison, so the same path can be checked against and then moved forward
+    if save_baseline:
+        with open(save_baseline, "w") as fs:
+            json.dump(report, fs, indent=2)
+        print("Baseline saved to {0}".format(save_baseline), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,38 @@
 from __future__ import print_function
 
 import logging
-from typing import List
+import threading
+from typing import List, Optional
 
+from archive import ChatArchive, format_record, parse_time
+from jobs import ChatJob, JobRunner, JobScriptError
 from lang import Lang
 from player import Player
+from sinks import ChatSinks
+from startup import FleetReloader
 
 
 class ChatBot:
-    def __init__(self, players: List[Player], lang: Lang):
+    def __init__(self,
+                 players: List[Player],
+                 lang: Lang,
+                 archive: Optional[ChatArchive] = None,
+                 reloader: Optional[FleetReloader] = None,
+                 jobs: Optional[JobRunner] = None,
+                 sinks: Optional[ChatSinks] = None):
         self.__logger = logging.getLogger("Bot")
         self.__lang = lang
+        self.__archive = archive
+        self.__reloader = reloader
+        self.__jobs = jobs
+        self.__sinks = sinks
         logging.basicConfig(level=logging.INFO)
         self.__players = players
+        # The console and every control connection call handle_text from their own threads
+        self.__lock = threading.Lock()
 
     def __find_player(self, username: str) -> Player:
-        for player in self.__players:
+        for player in list(self.__players):
             if player.username == username:
                 return player
         raise PlayerNotFoundException(username, self.__lang.lang("bot.player.not_found").format(username=username))
@@ -25,7 +42,7 @@ class ChatBot:
     def command_respawn(self, args: List[str]):
         if len(args) == 0:
             self.__logger.info(self.__lang.lang("bot.player.respawn.all"))
-            for player in self.__players:
+            for player in list(self.__players):
                 player.respawn()
         else:
             arg = args[0]
@@ -51,7 +68,7 @@ class ChatBot:
 
     def command_disconnect(self, args: List[str]):
         if len(args) == 0:
-            for player in self.__players:
+            for player in list(self.__players):
                 player.disconnect()
         else:
             arg = args[0]
@@ -64,7 +81,7 @@ class ChatBot:
 
     def command_reconnect(self, args: List[str]):
         if len(args) == 0:
-            for player in self.__players:
+            for player in list(self.__players):
                 player.reconnect()
         else:
             arg = args[0]
@@ -97,6 +114,169 @@ class ChatBot:
             else:
                 player.toggle_auto_reconnect()
 
+    def command_queue(self, args: List[str]):
+        if len(args) == 0:
+            players = [player for player in list(self.__players) if player.authenticated]
+        else:
+            try:
+                players = [self.__find_player(args[0])]
+            except PlayerNotFoundException as e1:
+                self.__logger.error(e1.message)
+                return
+        for player in players:
+            queue = player.chat_queue
+            self.__logger.info(self.__lang.lang("bot.player.queue").format(
+                username=player.username,
+                depth=queue.depth,
+                sent=queue.sent,
+                dropped=queue.dropped,
+                failed=queue.failed
+            ))
+
+    def command_search(self, args: List[str]):
+        if self.__archive is None:
+            self.__logger.error(self.__lang.lang("bot.search.disabled"))
+            return
+        bots = []
+        since = None
+        until = None
+        limit = 20
+        words = []
+        try:
+            for word in " ".join(args).split(" "):
+                if word.startswith("bot:"):
+                    bots.append(word[4:])
+                elif word.startswith("since:"):
+                    since = parse_time(word[6:])
+                elif word.startswith("until:"):
+                    until = parse_time(word[6:])
+                elif word.startswith("limit:"):
+                    limit = int(word[6:])
+                elif word != "":
+                    words.append(word)
+        except ValueError as e1:
+            self.__logger.error(str(e1))
+            self.__logger.info(self.__lang.lang("bot.search.usage"))
+            return
+        records = self.__archive.search(" ".join(words), bots, since, until, limit)
+        for record in records:
+            self.__logger.info(format_record(record))
+        self.__logger.info(self.__lang.lang("bot.search.result").format(count=len(records)))
+
+    def command_stats(self, args: List[str]):
+        if len(args) == 0:
+            players = [player for player in list(self.__players) if player.authenticated]
+        else:
+            try:
+                players = [self.__find_player(args[0])]
+            except PlayerNotFoundException as e1:
+                self.__logger.error(e1.message)
+                return
+        for player in players:
+            metrics = player.metrics
+            self.__logger.info(self.__lang.lang("bot.stats.player").format(
+                username=player.username,
+                connected=metrics.is_connected,
+                uptime="{0:.0f}".format(metrics.connected_seconds),
+                packets=sum(metrics.packets.values()),
+                kib="{0:.0f}".format(metrics.bytes_received / 1024),
+                received=metrics.chat_received,
+                sent=player.chat_queue.sent,
+                backlog=player.chat_queue.depth,
+                reconnects=metrics.reconnects,
+                ping="-" if metrics.tab_ping_seconds is None else "{0:.0f}".format(metrics.tab_ping_seconds * 1000)
+            ))
+        samples, seconds = self.__lang.render_timing
+        self.__logger.info(self.__lang.lang("bot.stats.render").format(
+            samples=samples,
+            average="{0:.1f}".format(seconds / samples * 1e6 if samples > 0 else 0.0)
+        ))
+        for sink in self.__sinks.sinks if self.__sinks is not None else []:
+            self.__logger.info(self.__lang.lang("bot.stats.sink").format(
+                name=sink.name,
+                kind=sink.kind,
+                delivered=sink.delivered,
+                dropped=sink.dropped,
+                failures=sink.failures,
+                backlog=sink.backlog,
+                lag="{0:.1f}".format(sink.lag)
+            ))
+
+    # noinspection PyUnusedLocal
+    def command_reload(self, args: List[str]):
+        if self.__reloader is None:
+            self.__logger.error(self.__lang.lang("bot.reload.unavailable"))
+            return
+        self.__reloader.reload()
+
+    def __find_job(self, args: List[str]) -> Optional[ChatJob]:
+        if self.__jobs is None:
+            self.__logger.error(self.__lang.lang("bot.job.unavailable"))
+            return None
+        if len(args) == 0:
+            self.__logger.error(self.__lang.lang("bot.job.no_id"))
+            return None
+        try:
+            job = self.__jobs.get(int(args[0]))
+        except ValueError:
+            job = None
+        if job is None:
+            self.__logger.error(self.__lang.lang("bot.job.not_found").format(id=args[0]))
+        return job
+
+    # noinspection PyUnusedLocal
+    def command_jobs(self, args: List[str]):
+        if self.__jobs is None:
+            self.__logger.error(self.__lang.lang("bot.job.unavailable"))
+            return
+        jobs = self.__jobs.jobs
+        if len(jobs) == 0:
+            self.__logger.info(self.__lang.lang("bot.job.none"))
+        for job in jobs:
+            self.__logger.info(self.__lang.lang("bot.job.status").format(
+                id=job.id,
+                name=job.name,
+                state=job.state,
+                line=job.index,
+                total=len(job.steps),
+                sent=job.sent,
+                skipped=job.skipped
+            ))
+
+    def command_job_start(self, args: List[str]):
+        if self.__jobs is None:
+            self.__logger.error(self.__lang.lang("bot.job.unavailable"))
+            return
+        if len(args) == 0:
+            self.__logger.error(self.__lang.lang("bot.job.no_script"))
+            return
+        try:
+            job = self.__jobs.start(args[0])
+        except (OSError, JobScriptError) as e1:
+            self.__logger.error(self.__lang.lang("bot.job.load_failed").format(name=args[0], message=str(e1)))
+        else:
+            self.__logger.info(self.__lang.lang("bot.job.started").format(
+                id=job.id, name=job.name, total=len(job.steps)))
+
+    def command_job_pause(self, args: List[str]):
+        job = self.__find_job(args)
+        if job is not None:
+            self.__job_state(job, self.__jobs.pause(job))
+
+    def command_job_resume(self, args: List[str]):
+        job = self.__find_job(args)
+        if job is not None:
+            self.__job_state(job, self.__jobs.resume(job))
+
+    def command_job_cancel(self, args: List[str]):
+        job = self.__find_job(args)
+        if job is not None:
+            self.__job_state(job, self.__jobs.cancel(job))
+
+    def __job_state(self, job: ChatJob, changed: bool):
+        self.__logger.log(logging.INFO if changed else logging.ERROR, self.__lang.lang(
+            "bot.job.state" if changed else "bot.job.state_unchanged").format(id=job.id, state=job.state))
+
     # noinspection PyUnusedLocal
     def command_help(self, args: List[str]):
         self.__logger.info(self.__lang.lang("bot.player.command.list"))
@@ -128,20 +308,22 @@ class ChatBot:
     #                 "Player {0} not found.".format(cmd[1]))
 
     def handle_text(self, text: str):
-        if text.startswith("~"):
-            raw = text.split(" ", 2)
-            command = raw[0].lower()[1:]
-            args = raw[1:]
-            name = "command_{0}".format(command)
-            try:
-                method = getattr(self, name)
-            except AttributeError:
-                self.__logger.error(self.__lang.lang("bot.player.command.not_found").format(command=command))
+        """Run a ~command or send text as chat from every player, one call at a time."""
+        with self.__lock:
+            if text.startswith("~"):
+                raw = text.split(" ", 2)
+                command = raw[0].lower()[1:]
+                args = raw[1:]
+                name = "command_{0}".format(command)
+                try:
+                    method = getattr(self, name)
+                except AttributeError:
+                    self.__logger.error(self.__lang.lang("bot.player.command.not_found").format(command=command))
+                else:
+                    method(args)
             else:
-                method(args)
-        else:
-            for player in self.__players:
-                player.chat(text)
+                for player in list(self.__players):
+                    player.chat(text)
 
     def start_listening(self):
         while True:
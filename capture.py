@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import atexit
+import cProfile
+import logging
+import os
+import pstats
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from minecraft.networking.packets import clientbound
+
+_MAGIC = b"MCCAP\x02"
+_HEADER = struct.Struct(">dHB")  # seconds since capture start, bot index, record type
+# Version 1 captures used one byte for the bot index
+_HEADERS = {b"MCCAP\x01": struct.Struct(">dBB"), _MAGIC: _HEADER}
+_HEALTH = struct.Struct(">fif")
+_LENGTH = struct.Struct(">I")
+
+BOT = 0
+JOIN_GAME = 1
+CHAT = 2
+HEALTH = 3
+DISCONNECT = 4
+
+
+class PacketCapture:
+    """
+    Appends the clientbound packets players listen to into one compact binary file:
+    a magic header, then records of (time, bot index, type) followed by the packet fields.
+    Bot names are written once as BOT records and referred to by index afterwards.
+    """
+
+    def __init__(self, path: str):
+        self.__logger = logging.getLogger("Capture")
+        logging.basicConfig(level=logging.INFO)
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder != "" and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.__fs = open(path, "wb")
+        self.__fs.write(_MAGIC)
+        self.__start = time.monotonic()
+        self.__bots = {}
+        self.__lock = threading.Lock()
+        self.records = 0
+        atexit.register(self.close)
+        self.__logger.info("Capturing packets to {0}".format(path))
+
+    def __bot(self, username: str, now: float) -> Optional[int]:
+        if username in self.__bots:
+            return self.__bots[username]
+        index = len(self.__bots)
+        if index > 0xFFFF:
+            # Runs on the networking thread, so stop recording new bots rather than raise into pyCraft
+            if index == 0x10000:
+                self.__logger.warning("Too many bots in one capture, not recording any more of them")
+            self.__bots[username] = None
+            return None
+        self.__bots[username] = index
+        name = username.encode("utf-8")
+        self.__fs.write(_HEADER.pack(now, index, BOT) + _LENGTH.pack(len(name)) + name)
+        return index
+
+    def write(self, username: str, packet):
+        now = time.monotonic() - self.__start
+        if isinstance(packet, clientbound.play.ChatMessagePacket):
+            data = packet.json_data.encode("utf-8")
+            record_type, body = CHAT, _LENGTH.pack(len(data)) + data + struct.pack(">b", packet.position)
+        elif isinstance(packet, clientbound.play.UpdateHealthPacket):
+            record_type, body = HEALTH, _HEALTH.pack(packet.health, packet.food, packet.food_saturation)
+        elif isinstance(packet, clientbound.play.DisconnectPacket):
+            data = packet.json_data.encode("utf-8")
+            record_type, body = DISCONNECT, _LENGTH.pack(len(data)) + data
+        elif isinstance(packet, clientbound.play.JoinGamePacket):
+            record_type, body = JOIN_GAME, b""
+        else:
+            return
+        with self.__lock:
+            index = self.__bot(username, now)
+            if index is None:
+                return
+            self.__fs.write(_HEADER.pack(now, index, record_type) + body)
+            self.records += 1
+
+    def close(self):
+        with self.__lock:
+            if not self.__fs.closed:
+                self.__fs.close()
+
+
+class _TruncatedRecord(Exception):
+    pass
+
+
+def _read_exact(fs, size: int) -> bytes:
+    data = fs.read(size)
+    if len(data) < size:
+        raise _TruncatedRecord()
+    return data
+
+
+def _read_string(fs) -> str:
+    return _read_exact(fs, _LENGTH.unpack(_read_exact(fs, _LENGTH.size))[0]).decode("utf-8")
+
+
+def _read_records(path: str) -> Iterator[Tuple[float, str, object]]:
+    with open(path, "rb") as fs:
+        header_format = _HEADERS.get(fs.read(len(_MAGIC)))
+        if header_format is None:
+            raise ValueError("{0} is not a packet capture".format(path))
+        bots = {}
+        while True:
+            header = fs.read(header_format.size)
+            if len(header) < header_format.size:
+                return
+            timestamp, index, record_type = header_format.unpack(header)
+            if record_type == BOT:
+                bots[index] = _read_string(fs)
+                continue
+            if record_type == CHAT:
+                packet = clientbound.play.ChatMessagePacket()
+                packet.json_data = _read_string(fs)
+                packet.position = struct.unpack(">b", _read_exact(fs, 1))[0]
+            elif record_type == HEALTH:
+                packet = clientbound.play.UpdateHealthPacket()
+                packet.health, packet.food, packet.food_saturation = _HEALTH.unpack(_read_exact(fs, _HEALTH.size))
+            elif record_type == DISCONNECT:
+                packet = clientbound.play.DisconnectPacket()
+                packet.json_data = _read_string(fs)
+            elif record_type == JOIN_GAME:
+                packet = clientbound.play.JoinGamePacket()
+            else:
+                raise ValueError("Unknown record type {0} in {1}".format(record_type, path))
+            yield timestamp, bots[index], packet
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str, object]]:
+    """Yield (seconds since capture start, bot name, rebuilt packet) for every record in a capture."""
+    try:
+        for record in _read_records(path):
+            yield record
+    except (_TruncatedRecord, struct.error, UnicodeDecodeError):
+        # The last record was cut short, e.g. the bot was killed mid-write; a body shorter than its length
+        # prefix stops here, so half a JSON text or UTF-8 sequence never reaches the handlers
+        return
+
+
+def replay(path: str, speed: float = 0.0) -> dict:
+    """
+    Feed a capture into the handlers of offline players, one per captured bot. speed 0 replays as fast
+    as possible, 1 at the original pace, 2 twice as fast and so on.
+    """
+    from benchmark import make_players
+    from lang import Lang
+
+    records = list(read_capture(path))
+    names = []
+    for _, name, _ in records:
+        if name not in names:
+            names.append(name)
+    lang = Lang("en_us")
+    with tempfile.TemporaryDirectory() as data_folder:
+        players = {player.username: player for player in make_players(names, lang, data_folder)}
+        handlers = {
+            clientbound.play.ChatMessagePacket: "print_chat",
+            clientbound.play.UpdateHealthPacket: "handle_health_change",
+            clientbound.play.DisconnectPacket: "handle_disconnect",
+            clientbound.play.JoinGamePacket: "handle_join_game"
+        }
+        start = time.monotonic()
+        for timestamp, name, packet in records:
+            if speed > 0:
+                delay = start + timestamp / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            getattr(players[name], handlers[type(packet)])(packet)
+        elapsed = time.monotonic() - start
+        for player in players.values():
+            player.disconnect()
+    return {
+        "packets": len(records),
+        "bots": len(names),
+        "seconds": elapsed,
+        "packets_per_second": len(records) / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a packet capture into the player handlers offline")
+    parser.add_argument("capture", help="capture written with app.py --capture")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="0 for as fast as possible (default), 1 for the original pace, 2 for twice as fast")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE")
+    parser.add_argument("--quiet", action="store_true", help="don't log what the handlers log")
+    args = parser.parse_args()
+
+    capture = os.path.abspath(args.capture)
+    profile = os.path.abspath(args.profile) if args.profile else None
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(level=logging.INFO)
+    if args.quiet:
+        logging.disable(logging.CRITICAL)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    result = replay(capture, args.speed)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+    print("Replayed {packets} packets for {bots} bots in {seconds:.3f}s ({packets_per_second:.0f} packets/s)".format(
+        **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from archive import ChatArchive
+from lang import Lang
+from sinks import ChatSinks
+
+
+class _ChatGroup:
+    def __init__(self, key: tuple, position: str, json_data: str, username: str, logger: logging.Logger,
+                 lang: Lang, due: float):
+        self.key = key
+        self.position = position
+        self.json_data = json_data
+        self.lang = lang
+        self.usernames = [username]  # type: List[str]
+        self.logger = logger
+        self.time = time.time()
+        self.due = due
+
+
+class ChatAggregator:
+    """
+    Collapses the same chat message arriving at several bots within a short window into one rendered
+    log line listing the bots that received it.
+
+    Whispers, command feedback and action bar messages are always logged per bot, and a message a bot
+    receives twice starts a new group, so per-player messages that happen to be identical are never
+    merged. Groups are logged in the order they started, by one drain, so a bot's messages never swap
+    places; with a single bot online there is nothing to merge and lines are logged as they arrive.
+    Groups still collecting are drained by the aggregator's own thread, so chat never waits behind
+    reconnects and logins on the scheduler's workers.
+    """
+
+    # Whispers and the results or errors of a player's own commands
+    __per_player = re.compile(r'"translate"\s*:\s*"(?:commands?|argument)\.')
+
+    def __init__(self,
+                 lang: Lang,
+                 window: float,
+                 archive: Optional[ChatArchive] = None,
+                 sinks: Optional[ChatSinks] = None):
+        self.__logger = logging.getLogger("Chat")
+        logging.basicConfig(level=logging.INFO)
+        self.__lang = lang
+        self.__window = window
+        self.__archive = archive
+        self.__sinks = sinks
+        self.__groups = {}  # type: Dict[tuple, _ChatGroup]
+        self.__order = deque()  # type: Deque[_ChatGroup]
+        self.__online = set()
+        self.__lock = threading.Lock()
+        self.__due = threading.Condition(self.__lock)
+        self.__emit_lock = threading.Lock()
+        self.__thread = threading.Thread(target=self.__run, name="Chat", daemon=True)
+        self.__thread.start()
+
+    def joined(self, username: str):
+        with self.__lock:
+            self.__online.add(username)
+
+    def left(self, username: str):
+        with self.__lock:
+            self.__online.discard(username)
+
+    def __is_per_player(self, chat_packet) -> bool:
+        if chat_packet.position == chat_packet.Position.GAME_INFO:
+            return True
+        return self.__per_player.search(chat_packet.json_data) is not None
+
+    def receive(self, username: str, logger: logging.Logger, chat_packet, lang: Optional[Lang] = None):
+        """Log a message in the receiving bot's locale (lang), grouped with bots of the same locale."""
+        lang = lang if lang is not None else self.__lang
+        key = (chat_packet.position, chat_packet.json_data, lang.lang_name)
+        with self.__lock:
+            immediate = self.__window <= 0 or len(self.__online) <= 1 or self.__is_per_player(chat_packet)
+            previous = None if immediate else self.__groups.get(key)
+            if previous is not None and username not in previous.usernames:
+                previous.usernames.append(username)
+                return
+            group = _ChatGroup(key, chat_packet.field_string('position'), chat_packet.json_data, username, logger,
+                               lang, 0.0 if immediate else time.monotonic() + self.__window)
+            if not immediate:
+                # A duplicate from a bot already in previous closes it; it is still logged in its turn
+                self.__groups[key] = group
+            self.__order.append(group)
+            self.__due.notify()
+        if immediate:
+            self.__drain()
+
+    def __drain(self):
+        """Log every group that is due, oldest first; groups behind one still collecting bots wait for it."""
+        with self.__emit_lock:
+            while True:
+                with self.__lock:
+                    if len(self.__order) == 0 or self.__order[0].due > time.monotonic():
+                        break
+                    group = self.__order.popleft()
+                    if self.__groups.get(group.key) is group:
+                        del self.__groups[group.key]
+                self.__emit(group)
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                while len(self.__order) == 0 or self.__order[0].due > time.monotonic():
+                    self.__due.wait(self.__order[0].due - time.monotonic() if len(self.__order) > 0 else None)
+            self.__drain()
+
+    def __emit(self, group: _ChatGroup):
+        # Both flavors come from the same tokenized spans; the plain one goes to the log file, archive and sinks
+        message = group.lang.parse_json_string(group.json_data)
+        plain = group.lang.parse_json_string(group.json_data, "plain")
+        if len(group.usernames) == 1:
+            line = "[{position}] {message}"
+            logger = group.logger
+        else:
+            line = "[{position}] [{usernames}] {message}"
+            logger = self.__logger
+        usernames = ", ".join(group.usernames)
+        logger.info(line.format(position=group.position, usernames=usernames, message=message), extra={
+            "plain": line.format(position=group.position, usernames=usernames, message=plain)
+        })
+        if self.__archive is not None:
+            self.__archive.record(group.time, group.usernames, group.position, group.json_data, plain)
+        if self.__sinks is not None:
+            self.__sinks.publish(group.time, group.usernames, group.position, group.json_data, plain)
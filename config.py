@@ -2,63 +2,155 @@
 
 from __future__ import print_function
 
+import copy
 import json
 import logging
 
 
+class ConfigError(Exception):
+    """Raised instead of exiting when a reload finds config.json missing or malformed."""
+    pass
+
+
 class Config:
-    def __init__(self, testing=False):
+    path = "./config.json"
+    __default_config = {
+        "//accounts": "A list of accounts",
+        "accounts": [{
+            "email": "",
+            "password": "",
+            "disabled": False
+        }],
+        "//server": "servers to connect to",
+        "server": {
+            "ip": "localhost",
+            "port": 25565
+        },
+        "//lang": "console language and the default locale of every account, override with lang on an account",
+        "lang": "en_us",
+        "auto_reconnect": True,
+        "auto_respawn": True,
+        "//chat_only": "minimum view distance and no chunk or entity decoding, override with chat_only on an account",
+        "chat_only": False,
+        "//startup": "concurrency: accounts started at once, logins_per_second: 0 for no limit",
+        "startup": {
+            "concurrency": 4,
+            "logins_per_second": 1.0
+        },
+        "//session": "seconds a validated token is reused without asking the auth server, and background renewal; "
+                     "auth_per_second: background refreshes and logins, 0 for no limit",
+        "session": {
+            "validation_ttl": 3600,
+            "refresh_age": 3000,
+            "refresh_spread": 300,
+            "check_interval": 60,
+            "auth_per_second": 1.0
+        },
+        "//outbound": "chat sent per account and across all accounts, per second and in a burst",
+        "outbound": {
+            "queue_size": 20,
+            "messages_per_second": 1.0,
+            "burst": 3,
+            "global_messages_per_second": 10.0,
+            "global_burst": 10
+        },
+        "//reconnect": "backoff in seconds, max_retries: -1 to retry forever, max_in_flight: 0 for no limit",
+        "reconnect": {
+            "base_delay": 5.0,
+            "max_delay": 300.0,
+            "multiplier": 2.0,
+            "jitter": 0.5,
+            "max_retries": 5,
+            "max_in_flight": 5,
+            "attempt_timeout": 30.0,
+            "probe_interval": 30.0,
+            "wake_spread": 30.0
+        },
+        "//chat": "dedup_window: seconds to collect the same message from several bots, 0 to log per bot",
+        "chat": {
+            "dedup_window": 0.5
+        },
+        "//health": "seconds between health summaries per bot (0 logs every update), and levels logged when crossed",
+        "health": {
+            "interval": 30.0,
+            "health_thresholds": [6],
+            "food_thresholds": [6]
+        },
+        "//archive": "searchable chat history, rotated into a new segment by record count or age in seconds",
+        "archive": {
+            "enabled": True,
+            "folder": "./archive",
+            "segment_records": 10000,
+            "segment_seconds": 3600
+        },
+        "//sinks": "forward chat in batches of batch_size records or batch_seconds; a failed batch is retried "
+                   "max_retries times and records past capacity are dropped. outputs: {\"type\": \"jsonl\", "
+                   "\"path\": ...}, {\"type\": \"socket\", \"path\": ...} or host and port, "
+                   "{\"type\": \"webhook\", \"url\": ...}, each may override the batch settings",
+        "sinks": {
+            "batch_size": 100,
+            "batch_seconds": 1.0,
+            "capacity": 10000,
+            "retry_interval": 1.0,
+            "max_retries": 5,
+            "outputs": []
+        },
+        "//metrics": "serve Prometheus metrics on http://host:port/metrics",
+        "metrics": {
+            "http_enabled": False,
+            "host": "127.0.0.1",
+            "port": 9465
+        },
+        "//sharding": "workers: processes to spread accounts over, 1 to run everything in this process",
+        "sharding": {
+            "workers": 1
+        },
+        "//control": "local command endpoint: unix_socket path (empty to disable), optional TCP listener on host:port",
+        "control": {
+            "unix_socket": "./control.sock",
+            "tcp_enabled": False,
+            "host": "127.0.0.1",
+            "port": 9466
+        },
+        "//jobs": "chat scripts for ~job_start: a step waits while a bot has max_backlog messages queued",
+        "jobs": {
+            "folder": "./jobs",
+            "max_backlog": 2,
+            "retry_interval": 0.5
+        },
+        "//reload": "seconds between checks of config.json for changes, 0 to only reload with ~reload",
+        "reload": {
+            "interval": 2.0
+        }
+    }
+
+    def __init__(self, testing=False, reloading=False):
         self.__logger = logging.getLogger("Config")
         logging.basicConfig(level=logging.INFO)
         self.__logger.info("Loading Config...")
         if testing:
             self.__logger.info("Testing mode detected, using testing config.")
-            self.__configRaw = {
-                "//accounts": "A list of accounts",
-                "accounts": [{
-                    "email": "",
-                    "password": "",
-                    "disabled": False
-                }],
-                "//server": "servers to connect to",
-                "server": {
-                    "ip": "localhost",
-                    "port": 25565
-                },
-                "lang": "en_us",
-                "auto_reconnect": True,
-                "auto_respawn": True
-            }
+            self.__configRaw = copy.deepcopy(self.__default_config)
         else:
             try:
-                with open('./config.json', 'r') as fs:
+                with open(self.path, 'r') as fs:
                     self.__configRaw = json.load(fs)
             except FileNotFoundError:
+                if reloading:
+                    self.__logger.error("Can't reload config.json: File not found.")
+                    raise ConfigError("config.json not found")
                 self.__logger.error(
                     "Can't load config.json: File not found.")
                 self.__logger.info("Generating empty config...")
-                self.__configRaw = {
-                    "//accounts": "A list of accounts",
-                    "accounts": [{
-                        "email": "",
-                        "password": "",
-                        "disabled": False
-                    }],
-                    "//server": "servers to connect to",
-                    "server": {
-                        "ip": "localhost",
-                        "port": 25565
-                    },
-                    "lang": "en_us",
-                    "auto_reconnect": True,
-                    "auto_respawn": True
-                }
+                self.__configRaw = copy.deepcopy(self.__default_config)
                 self.__save_config()
                 self.__logger.error("Fill your config and try again.")
                 exit()
             except json.decoder.JSONDecodeError as e1:
                 self.__logger.error(
                     "Can't load config.json: JSON decode error:{0}".format(str(e1.args)))
+                if reloading:
+                    raise ConfigError(str(e1))
                 self.__logger.error("Check your config format and try again.")
                 exit()
         self.accounts = self.__configRaw["accounts"]
@@ -66,7 +158,27 @@ class Config:
         self.lang = self.__configRaw["lang"]
         self.auto_reconnect = self.__configRaw["auto_reconnect"]
         self.auto_respawn = self.__configRaw["auto_respawn"]
+        self.chat_only = self.__configRaw.get("chat_only", self.__default_config["chat_only"])
+        self.startup = self.__section("startup")
+        self.session = self.__section("session")
+        self.outbound = self.__section("outbound")
+        self.reconnect = self.__section("reconnect")
+        self.chat = self.__section("chat")
+        self.health = self.__section("health")
+        self.archive = self.__section("archive")
+        self.sinks = self.__section("sinks")
+        self.metrics = self.__section("metrics")
+        self.sharding = self.__section("sharding")
+        self.reload = self.__section("reload")
+        self.control = self.__section("control")
+        self.jobs = self.__section("jobs")
+
+    def __section(self, name: str) -> dict:
+        # Sections added after the first release may be missing or partial in older configs
+        section = copy.deepcopy(self.__default_config[name])
+        section.update(self.__configRaw.get(name, {}))
+        return section
 
     def __save_config(self):
-        with open('./config.json', 'w') as fs:
+        with open(self.path, 'w') as fs:
             json.dump(self.__configRaw, fs, indent=2)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+from typing import Callable, List, Optional
+
+
+class _Capture(logging.Handler):
+    """Collects the records logged by threads that are currently running a control command."""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.INFO)
+        self.__local = threading.local()
+
+    def start(self):
+        self.__local.records = []
+
+    def stop(self) -> List[logging.LogRecord]:
+        records = self.__local.records
+        self.__local.records = None
+        return records
+
+    def emit(self, record):
+        records = getattr(self.__local, "records", None)
+        if records is not None:
+            records.append(record)
+
+
+class ControlServer:
+    """
+    Local control endpoint. Clients send newline-delimited commands, either bare text or JSON
+    {"id": ..., "text": "~stats"}, or a JSON array of those as one batch. Each line is answered with one
+    JSON line (an array for a batch) holding what the command logged and whether it logged an error.
+    Commands go through the same handle_text as the console, which runs them one at a time.
+    """
+
+    def __init__(self,
+                 handle_text: Callable[[str], None],
+                 unix_path: Optional[str] = None,
+                 host: str = "127.0.0.1",
+                 port: Optional[int] = None):
+        self.__logger = logging.getLogger("Control")
+        logging.basicConfig(level=logging.INFO)
+        self.__handle_text = handle_text
+        self.__capture = _Capture()
+        logging.getLogger().addHandler(self.__capture)
+        self.__servers = []
+        self.__unix_path = None
+
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    line = line.decode("utf-8", "replace").strip()
+                    if line == "":
+                        continue
+                    self.wfile.write((json.dumps(control.execute_line(line), ensure_ascii=False) + "\n")
+                                     .encode("utf-8"))
+
+        if unix_path:
+            if not hasattr(socketserver, "UnixStreamServer"):
+                self.__logger.warning("Unix sockets are not available on this platform, skipping {0}".format(
+                    unix_path))
+            elif self.__claim(unix_path):
+                self.__serve(_ThreadingUnixServer(unix_path, Handler), "unix:{0}".format(unix_path))
+                self.__unix_path = unix_path
+                atexit.register(self.close)
+        if port is not None:
+            server = _ThreadingTCPServer((host, port), Handler)
+            self.__serve(server, "tcp:{0}:{1}".format(host, server.server_address[1]))
+
+    def __claim(self, path: str) -> bool:
+        """Remove a socket file left behind by a previous run, unless another instance still listens on it."""
+        if not os.path.exists(path):
+            return True
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return True
+        finally:
+            probe.close()
+        self.__logger.error("Control socket {0} is in use by another instance".format(path))
+        return False
+
+    def __serve(self, server: socketserver.BaseServer, address: str):
+        self.__servers.append(server)
+        threading.Thread(target=server.serve_forever, name="Control", daemon=True).start()
+        self.__logger.info("Listening for control commands on {0}".format(address))
+
+    def execute(self, text: str, command_id=None) -> dict:
+        """Run one command or chat line and return its captured log output."""
+        self.__capture.start()
+        error = None
+        try:
+            self.__handle_text(text)
+        except Exception as e:
+            error = "{0}: {1}".format(type(e).__name__, str(e))
+        finally:
+            records = self.__capture.stop()
+        output = []
+        for record in records:
+            plain = getattr(record, "plain", None)
+            output.append({
+                "level": record.levelname,
+                "logger": record.name,
+                "message": plain if plain is not None else record.getMessage()
+            })
+        result = {
+            "ok": error is None and all(record.levelno < logging.ERROR for record in records),
+            "output": output
+        }
+        if command_id is not None:
+            result["id"] = command_id
+        if error is not None:
+            result["error"] = error
+        return result
+
+    def execute_line(self, line: str):
+        if not line.startswith(("{", "[")):
+            return self.execute(line)
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"ok": False, "output": [], "error": "Invalid JSON: {0}".format(str(e))}
+        if type(request) == list:
+            return [self.__execute_request(item) for item in request]
+        return self.__execute_request(request)
+
+    def __execute_request(self, request) -> dict:
+        if type(request) == str:
+            return self.execute(request)
+        if type(request) != dict or type(request.get("text")) != str:
+            return {"ok": False, "output": [], "error": "Expected a string or an object with \"text\""}
+        return self.execute(request["text"], request.get("id"))
+
+    def close(self):
+        for server in self.__servers:
+            server.shutdown()
+            server.server_close()
+        self.__servers = []
+        if self.__unix_path is not None and os.path.exists(self.__unix_path):
+            os.unlink(self.__unix_path)
+            self.__unix_path = None
+        logging.getLogger().removeHandler(self.__capture)
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send commands to a running bot over its control socket")
+    parser.add_argument("commands", nargs="*", help="commands or chat lines (default: one per line from stdin)")
+    parser.add_argument("--socket", default="./control.sock", help="unix socket path (default: ./control.sock)")
+    parser.add_argument("--port", type=int, help="connect over TCP on --host instead of the unix socket")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host (default: 127.0.0.1)")
+    args = parser.parse_args()
+    commands = args.commands or [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    if args.port is not None:
+        connection = socket.create_connection((args.host, args.port))
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(args.socket)
+    ok = True
+    with connection, connection.makefile("rwb") as stream:
+        # Send everything as one batch so the whole run costs a single round trip
+        stream.write((json.dumps(commands, ensure_ascii=False) + "\n").encode("utf-8"))
+        stream.flush()
+        for result in json.loads(stream.readline().decode("utf-8")):
+            ok = ok and result["ok"]
+            print(json.dumps(result, ensure_ascii=False))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
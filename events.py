@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import threading
+from typing import Optional, Tuple
+
+from lang import Lang
+from scheduler import Scheduler
+
+
+class _HealthState:
+    def __init__(self, logger: logging.Logger, lang: Lang):
+        self.logger = logger
+        self.lang = lang
+        self.health = None  # type: Optional[float]
+        self.food = None  # type: Optional[int]
+        self.saturation = None  # type: Optional[float]
+        self.updates = 0
+
+
+class HealthEvents:
+    """
+    Coalesces UpdateHealth packets. The latest health, food and saturation of every bot are kept and
+    summarized once per interval; death, coming back alive and dropping below a threshold are logged
+    as they happen. The networking thread only updates the state, so a bot in a farm or starving no
+    longer floods the log. An interval of 0 logs every update.
+    """
+
+    def __init__(self, lang: Lang, scheduler: Scheduler, options: dict):
+        self.__lang = lang
+        self.__scheduler = scheduler
+        self.__interval = float(options["interval"])
+        self.__health_thresholds = sorted((float(i) for i in options["health_thresholds"]), reverse=True)
+        self.__food_thresholds = sorted((int(i) for i in options["food_thresholds"]), reverse=True)
+        self.__lock = threading.Lock()
+        self.__states = {}
+        if self.__interval > 0:
+            self.__scheduler.schedule(self.__interval, self.__flush)
+
+    @staticmethod
+    def __crossed(thresholds: list, previous, current) -> Optional[float]:
+        for threshold in thresholds:
+            if previous >= threshold > current:
+                return threshold
+        return None
+
+    def __transition(self, state: _HealthState, health: float, food: int) -> Optional[Tuple[int, str, dict]]:
+        if health <= 0 < (state.health if state.health is not None else 1):
+            return logging.WARNING, "player.health.died", {}
+        if state.health is None:
+            return None
+        if state.health <= 0 < health:
+            return logging.INFO, "player.health.alive", {}
+        threshold = self.__crossed(self.__health_thresholds, state.health, health)
+        if threshold is not None and health > 0:
+            return logging.WARNING, "player.health.low", {"threshold": threshold}
+        threshold = self.__crossed(self.__food_thresholds, state.food, food)
+        if threshold is not None:
+            return logging.WARNING, "player.food.low", {"threshold": threshold}
+        return None
+
+    def update(self, username: str, logger: logging.Logger, health: float, food: int, saturation: float,
+               lang: Optional[Lang] = None):
+        """Record a bot's health; its messages are logged in the bot's locale (lang), else the fleet's."""
+        lang = lang if lang is not None else self.__lang
+        with self.__lock:
+            state = self.__states.get(username)
+            if state is None:
+                state = _HealthState(logger, lang)
+                self.__states[username] = state
+            transition = self.__transition(state, health, food)
+            state.logger = logger
+            state.lang = lang
+            state.health = health
+            state.food = food
+            state.saturation = saturation
+            state.updates += 1
+            if transition is None and self.__interval > 0:
+                return
+            updates = state.updates
+            state.updates = 0
+        if transition is None:
+            self.__emit(state, logging.INFO, "player.health.changed", {}, updates, health, food, saturation)
+        else:
+            level, key, extra = transition
+            self.__emit(state, level, key, extra, updates, health, food, saturation)
+
+    def forget(self, username: str):
+        with self.__lock:
+            self.__states.pop(username, None)
+
+    def __emit(self, state: _HealthState, level: int, key: str, extra: dict, updates: int,
+               health: float, food: int, saturation: float):
+        state.logger.log(level, state.lang.lang(key).format(
+            health=str(health),
+            food=str(food),
+            saturation=str(saturation),
+            updates=updates,
+            **extra
+        ))
+
+    def __flush(self):
+        try:
+            with self.__lock:
+                pending = []
+                for state in self.__states.values():
+                    if state.updates > 0:
+                        pending.append((state, state.updates, state.health, state.food, state.saturation))
+                        state.updates = 0
+            for state, updates, health, food, saturation in pending:
+                self.__emit(state, logging.INFO, "player.health.changed", {}, updates, health, food, saturation)
+        finally:
+            self.__scheduler.schedule(self.__interval, self.__flush)
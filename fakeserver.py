@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import logging
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+PROTOCOL = 498
+VERSION_NAME = "1.14.4"
+
+# Packet ids for protocol 498
+STATUS_RESPONSE = 0x00
+STATUS_PONG = 0x01
+LOGIN_DISCONNECT = 0x00
+LOGIN_SUCCESS = 0x02
+PLAY_CHAT = 0x0E
+PLAY_DISCONNECT = 0x1A
+PLAY_KEEP_ALIVE = 0x20
+PLAY_JOIN_GAME = 0x25
+PLAY_UPDATE_HEALTH = 0x48
+SERVERBOUND_CHAT = 0x03
+SERVERBOUND_CLIENT_STATUS = 0x04
+SERVERBOUND_KEEP_ALIVE = 0x0F
+
+
+def pack_varint(value: int) -> bytes:
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def unpack_varint(data: bytes, offset: int) -> tuple:
+    result = 0
+    for shift in range(0, 35, 7):
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            if result & 0x80000000:
+                result -= 1 << 32
+            return result, offset
+    raise ValueError("VarInt is too big")
+
+
+def pack_string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return pack_varint(len(data)) + data
+
+
+def unpack_string(data: bytes, offset: int) -> tuple:
+    length, offset = unpack_varint(data, offset)
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def frame(packet_id: int, *fields: bytes) -> bytes:
+    payload = pack_varint(packet_id) + b"".join(fields)
+    return pack_varint(len(payload)) + payload
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple:
+    length = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+    payload = await reader.readexactly(length)
+    packet_id, offset = unpack_varint(payload, 0)
+    return packet_id, payload[offset:]
+
+
+class _Client:
+    def __init__(self, name: str, entity_id: int, writer: asyncio.StreamWriter):
+        self.name = name
+        self.entity_id = entity_id
+        self.writer = writer
+        self.health = 20.0
+        self.keep_alive_id = None  # type: Optional[int]
+        self.keep_alive_sent = 0.0
+        self.last_keep_alive = time.monotonic()
+
+    def send(self, data: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class FakeServer:
+    """
+    A minimal offline-mode server for protocol 498: status, login, JoinGame, keepalive, chat echo and
+    broadcast, health updates and scripted disconnects. Runs its own event loop on a background thread;
+    every public method is safe to call from other threads.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 25565, keep_alive_interval: float = 10.0,
+                 keep_alive_timeout: float = 30.0, max_players: int = 1000):
+        self.__logger = logging.getLogger("FakeServer")
+        logging.basicConfig(level=logging.INFO)
+        self.host = host
+        self.port = port
+        self.__keep_alive_interval = keep_alive_interval
+        self.__keep_alive_timeout = keep_alive_timeout
+        self.__max_players = max_players
+        self.__clients = {}  # type: Dict[str, _Client]
+        self.__next_entity_id = 1
+        self.__loop = asyncio.new_event_loop()
+        self.__server = None
+        self.__thread = None
+        self.joins = 0
+        self.chat_messages = 0
+        self.join_times = {}  # type: Dict[str, float]
+
+    def start(self):
+        ready = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, args=(ready,), name="FakeServer", daemon=True)
+        self.__thread.start()
+        ready.wait()
+
+    def __run(self, ready: threading.Event):
+        asyncio.set_event_loop(self.__loop)
+        self.__loop.run_until_complete(self.__listen())
+        keep_alive = self.__loop.create_task(self.__keep_alive_loop())
+        ready.set()
+        self.__loop.run_forever()
+        keep_alive.cancel()
+        try:
+            self.__loop.run_until_complete(keep_alive)
+        except asyncio.CancelledError:
+            pass
+        self.__loop.close()
+
+    async def __listen(self):
+        self.__server = await asyncio.start_server(self.__handle, self.host, self.port, backlog=1024)
+        self.port = self.__server.sockets[0].getsockname()[1]
+        self.__logger.info("Listening on {host}:{port}".format(host=self.host, port=self.port))
+
+    def stop(self):
+        self.__loop.call_soon_threadsafe(self.__stop)
+        self.__thread.join()
+
+    def __stop(self):
+        self.__kick(None, "Server closed")
+        self.__server.close()
+        self.__loop.stop()
+
+    @property
+    def players(self) -> int:
+        return len(self.__clients)
+
+    def broadcast(self, text: str, position: int = 1):
+        self.__loop.call_soon_threadsafe(self.__broadcast, {"text": text}, position)
+
+    def set_health(self, name: Optional[str], health: float, food: int = 20, saturation: float = 5.0):
+        self.__loop.call_soon_threadsafe(self.__set_health, name, health, food, saturation)
+
+    def kick(self, name: Optional[str] = None, reason: str = "Kicked by script"):
+        """Disconnect one player, or everyone when name is None."""
+        self.__loop.call_soon_threadsafe(self.__kick, name, reason)
+
+    def restart(self, downtime: float):
+        """Drop every player and refuse connections for downtime seconds."""
+        asyncio.run_coroutine_threadsafe(self.__restart(downtime), self.__loop)
+
+    def __broadcast(self, component: dict, position: int):
+        data = frame(PLAY_CHAT, pack_string(json.dumps(component)), struct.pack(">b", position))
+        for client in list(self.__clients.values()):
+            client.send(data)
+
+    def __set_health(self, name: Optional[str], health: float, food: int, saturation: float):
+        for client in list(self.__clients.values()):
+            if name is None or client.name == name:
+                client.health = health
+                client.send(frame(PLAY_UPDATE_HEALTH, struct.pack(">f", health), pack_varint(food),
+                                  struct.pack(">f", saturation)))
+
+    def __kick(self, name: Optional[str], reason: str):
+        for client in list(self.__clients.values()):
+            if name is None or client.name == name:
+                client.send(frame(PLAY_DISCONNECT, pack_string(json.dumps({"text": reason}))))
+                client.writer.close()
+
+    async def __restart(self, downtime: float):
+        self.__logger.info("Restarting, down for {0}s".format(downtime))
+        self.__server.close()
+        await self.__server.wait_closed()
+        self.__kick(None, "Server closed")
+        await asyncio.sleep(downtime)
+        await self.__listen()
+
+    async def __keep_alive_loop(self):
+        while True:
+            await asyncio.sleep(self.__keep_alive_interval)
+            now = time.monotonic()
+            for client in list(self.__clients.values()):
+                if now - client.last_keep_alive > self.__keep_alive_timeout:
+                    self.__kick(client.name, "Timed out")
+                    continue
+                client.keep_alive_id = int(now * 1000)
+                client.keep_alive_sent = now
+                client.send(frame(PLAY_KEEP_ALIVE, struct.pack(">q", client.keep_alive_id)))
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            packet_id, data = await read_packet(reader)
+            if packet_id != 0x00:
+                return
+            protocol, offset = unpack_varint(data, 0)
+            address, offset = unpack_string(data, offset)
+            next_state, offset = unpack_varint(data, offset + 2)
+            if next_state == 1:
+                await self.__status(reader, writer)
+            elif next_state == 2:
+                await self.__login(reader, writer, protocol)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def __status(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            packet_id, data = await read_packet(reader)
+            if packet_id == 0x00:
+                writer.write(frame(STATUS_RESPONSE, pack_string(json.dumps({
+                    "version": {"name": VERSION_NAME, "protocol": PROTOCOL},
+                    "players": {"max": self.__max_players, "online": len(self.__clients)},
+                    "description": {"text": "Fake server"}
+                }))))
+            elif packet_id == 0x01:
+                writer.write(frame(STATUS_PONG, data))
+            await writer.drain()
+
+    async def __login(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, protocol: int):
+        packet_id, data = await read_packet(reader)
+        name, offset = unpack_string(data, 0)
+        if protocol != PROTOCOL:
+            writer.write(frame(LOGIN_DISCONNECT, pack_string(json.dumps({
+                "text": "Outdated client! Please use {0}".format(VERSION_NAME)
+            }))))
+            await writer.drain()
+            return
+        if name in self.__clients:
+            self.__kick(name, "You logged in from another location")
+        player_uuid = uuid.uuid3(uuid.NAMESPACE_OID, "OfflinePlayer:" + name)
+        writer.write(frame(LOGIN_SUCCESS, pack_string(str(player_uuid)), pack_string(name)))
+        client = _Client(name, self.__next_entity_id, writer)
+        self.__next_entity_id += 1
+        client.send(frame(
+            PLAY_JOIN_GAME,
+            struct.pack(">iBiB", client.entity_id, 0, 0, min(self.__max_players, 255)),
+            pack_string("default"),
+            pack_varint(2),
+            struct.pack(">?", False)
+        ))
+        client.send(frame(PLAY_UPDATE_HEALTH, struct.pack(">f", client.health), pack_varint(20),
+                          struct.pack(">f", 5.0)))
+        self.__clients[name] = client
+        self.joins += 1
+        self.join_times[name] = time.monotonic()
+        self.__broadcast({"translate": "multiplayer.player.joined", "color": "yellow", "with": [{"text": name}]}, 1)
+        try:
+            await self.__play(reader, client)
+        finally:
+            if self.__clients.get(name) is client:
+                del self.__clients[name]
+                self.__broadcast(
+                    {"translate": "multiplayer.player.left", "color": "yellow", "with": [{"text": name}]}, 1)
+
+    async def __play(self, reader: asyncio.StreamReader, client: _Client):
+        while True:
+            packet_id, data = await read_packet(reader)
+            if packet_id == SERVERBOUND_KEEP_ALIVE:
+                client.last_keep_alive = time.monotonic()
+            elif packet_id == SERVERBOUND_CHAT:
+                message, offset = unpack_string(data, 0)
+                self.chat_messages += 1
+                if message == "/kill":
+                    self.__set_health(client.name, 0.0, 20, 5.0)
+                else:
+                    self.__broadcast({"translate": "chat.type.text", "with": [{"text": client.name}, message]}, 0)
+            elif packet_id == SERVERBOUND_CLIENT_STATUS:
+                action, offset = unpack_varint(data, 0)
+                if action == 0 and client.health <= 0:
+                    self.__set_health(client.name, 20.0, 20, 5.0)
+
+
+def run_script(server: FakeServer, events: list):
+    """Run scripted events: [{"at": seconds, "action": "broadcast|health|kick|restart", ...}]."""
+    start = time.monotonic()
+    for event in sorted(events, key=lambda e: e["at"]):
+        time.sleep(max(0.0, start + event["at"] - time.monotonic()))
+        action = event["action"]
+        if action == "broadcast":
+            server.broadcast(event["text"], event.get("position", 1))
+        elif action == "health":
+            server.set_health(event.get("target"), event["health"], event.get("food", 20),
+                              event.get("saturation", 5.0))
+        elif action == "kick":
+            server.kick(event.get("target"), event.get("reason", "Kicked by script"))
+        elif action == "restart":
+            server.restart(event.get("downtime", 10.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in Minecraft {0} server (offline mode)".format(
+        VERSION_NAME))
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=25565, help="port to listen on (default: 25565)")
+    parser.add_argument("--keep-alive", type=float, default=10.0, help="seconds between keepalives (default: 10)")
+    parser.add_argument("--script", help="JSON file with a list of scripted events")
+    args = parser.parse_args()
+    server = FakeServer(args.host, args.port, keep_alive_interval=args.keep_alive)
+    server.start()
+    try:
+        if args.script:
+            with open(args.script, "r") as fs:
+                run_script(server, json.load(fs))
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import os
+import threading
+from collections import namedtuple
+from typing import List, Optional
+
+from lang import Lang
+from player import Player
+from scheduler import ScheduledTask, Scheduler
+
+Step = namedtuple("Step", ["delay", "bot", "message"])
+
+
+class JobScriptError(Exception):
+    def __init__(self, path: str, line: int, message: str):
+        Exception.__init__(self, "{0}:{1}: {2}".format(path, line, message))
+
+
+def load_script(path: str) -> List[Step]:
+    """
+    Read a chat script: one "<delay> <bot> <message>" per line, waiting delay seconds before the message.
+    A bot of * sends from every player; blank lines and lines starting with # are skipped.
+    """
+    steps = []
+    with open(path, "r", encoding="utf-8") as fs:
+        for number, line in enumerate(fs, 1):
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            parts = line.split(" ", 2)
+            if len(parts) < 3:
+                raise JobScriptError(path, number, "expected <delay> <bot> <message>")
+            try:
+                delay = float(parts[0])
+            except ValueError:
+                raise JobScriptError(path, number, "delay {0!r} is not a number".format(parts[0]))
+            if delay < 0:
+                raise JobScriptError(path, number, "delay can't be negative")
+            steps.append(Step(delay, parts[1], parts[2]))
+    return steps
+
+
+class ChatJob:
+    RUNNING = "running"
+    PAUSED = "paused"
+    CANCELLED = "cancelled"
+    DONE = "done"
+
+    def __init__(self, job_id: int, name: str, steps: List[Step]):
+        self.id = job_id
+        self.name = name
+        self.steps = steps
+        self.index = 0
+        self.state = self.RUNNING
+        self.sent = 0
+        self.skipped = 0
+        self.task = None  # type: Optional[ScheduledTask]
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (self.CANCELLED, self.DONE)
+
+
+class JobRunner:
+    """
+    Runs chat scripts on the shared scheduler, so any number of jobs cost no threads while they wait.
+    Messages still go through each player's outbound queue and rate limits; a step waits while one of
+    its bots has max_backlog messages queued, so long scripts never overflow the queue and get dropped.
+    """
+
+    __kept_finished = 20
+
+    def __init__(self, players: List[Player], lang: Lang, scheduler: Scheduler, options: dict):
+        self.__logger = logging.getLogger("Jobs")
+        logging.basicConfig(level=logging.INFO)
+        self.__players = players
+        self.__lang = lang
+        self.__scheduler = scheduler
+        self.__folder = options["folder"]
+        self.__max_backlog = max(int(options["max_backlog"]), 1)
+        self.__retry_interval = float(options["retry_interval"])
+        self.__lock = threading.Lock()
+        self.__jobs = []  # type: List[ChatJob]
+        self.__next_id = 1
+
+    @property
+    def jobs(self) -> List[ChatJob]:
+        with self.__lock:
+            return list(self.__jobs)
+
+    def __resolve(self, path: str) -> str:
+        if os.path.exists(path) or os.path.isabs(path):
+            return path
+        return os.path.join(self.__folder, path)
+
+    def start(self, path: str) -> ChatJob:
+        """Load a script and start it, raising OSError or JobScriptError if it can't be read."""
+        steps = load_script(self.__resolve(path))
+        with self.__lock:
+            job = ChatJob(self.__next_id, path, steps)
+            self.__next_id += 1
+            self.__jobs.append(job)
+            finished = [other for other in self.__jobs if other.finished]
+            for other in finished[:max(len(finished) - self.__kept_finished, 0)]:
+                self.__jobs.remove(other)
+            self.__schedule(job)
+        return job
+
+    def get(self, job_id: int) -> Optional[ChatJob]:
+        with self.__lock:
+            for job in self.__jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def pause(self, job: ChatJob) -> bool:
+        with self.__lock:
+            if job.state != ChatJob.RUNNING:
+                return False
+            job.state = ChatJob.PAUSED
+            if job.task is not None:
+                job.task.cancel()
+            return True
+
+    def resume(self, job: ChatJob) -> bool:
+        """Continue a paused job from its current line, without waiting that line's delay again."""
+        with self.__lock:
+            if job.state != ChatJob.PAUSED:
+                return False
+            job.state = ChatJob.RUNNING
+            job.task = self.__scheduler.schedule(0, self.__step, job)
+            return True
+
+    def cancel(self, job: ChatJob) -> bool:
+        with self.__lock:
+            if job.finished:
+                return False
+            job.state = ChatJob.CANCELLED
+            if job.task is not None:
+                job.task.cancel()
+            return True
+
+    def __schedule(self, job: ChatJob):
+        if job.index >= len(job.steps):
+            job.state = ChatJob.DONE
+            job.task = None
+            self.__logger.info(self.__lang.lang("bot.job.done").format(
+                id=job.id, name=job.name, sent=job.sent, skipped=job.skipped))
+            return
+        job.task = self.__scheduler.schedule(job.steps[job.index].delay, self.__step, job)
+
+    def __targets(self, bot: str) -> List[Player]:
+        return [player for player in list(self.__players)
+                if player.authenticated and (bot == "*" or player.username == bot)]
+
+    def __step(self, job: ChatJob):
+        with self.__lock:
+            if job.state != ChatJob.RUNNING:
+                return
+            step = job.steps[job.index]
+            targets = self.__targets(step.bot)
+            if any(player.chat_queue.depth >= self.__max_backlog for player in targets):
+                job.task = self.__scheduler.schedule(self.__retry_interval, self.__step, job)
+                return
+            for player in targets:
+                player.chat(step.message)
+            if len(targets) == 0:
+                # Bots that are gone, or run by another shard
+                job.skipped += 1
+            job.sent += len(targets)
+            job.index += 1
+            self.__schedule(job)
@@ -4,17 +4,44 @@ from __future__ import print_function
 
 import json
 import logging
+import marshal
 import os
+import sys
+import threading
+from typing import Dict, Iterable, Optional
 
 from colorama import init, Fore, Style, Back
 
+from renderer import DEFAULT_STYLE, ChatRenderer, ConsoleBackend, split_codes
+
+
+# Translation values seen by any Lang in this process, so equal strings in several locales are stored once
+_strings = {}  # type: Dict[str, str]
+
+
+def _share(table: dict) -> dict:
+    return {sys.intern(key): _strings.setdefault(value, value) if type(value) == str else value
+            for key, value in table.items()}
+
 
 class Lang:
-    __lang = {}
+    """
+    One locale's translations, resolved ahead of time: lang/custom overrides the locale's own files,
+    which override the en_us table passed as fallback (or loaded here when none is given).
+    """
+
+    fallback_lang = "en_us"
+    __snapshot_folder = "lang/snapshot"
+    __snapshot_version = 1
 
-    def __init__(self, lang: str = "en_us"):
+    def __init__(self, lang: str = "en_us", snapshot: bool = True, fallback: Optional[dict] = None):
         init(autoreset=True)
+        if fallback is None and lang != self.fallback_lang:
+            fallback = Lang(self.fallback_lang, snapshot).translations
+        self.__lang = dict(fallback) if fallback is not None else {}
+        self.__table = {}
         self.__color = Color()
+        self.__renderer = ChatRenderer(self.__lang, self.__color)
         self.lang_name = lang
         self.__logger = logging.getLogger("Translation")
         logging.basicConfig(level=logging.INFO)
@@ -22,18 +49,89 @@ class Lang:
         if not os.path.isdir("lang/custom"):
             os.mkdir("lang/custom")
         self.__find_lang("lang/custom")
+        sources = self.__stat_sources()
+        if not snapshot:
+            self.__load_sources()
+        elif not self.__load_snapshot(sources):
+            if self.__load_sources():
+                self.__save_snapshot(sources)
+        self.__renderer.clear_cache()
+
+    @property
+    def translations(self) -> dict:
+        return self.__lang
+
+    @property
+    def snapshot_path(self) -> str:
+        return "{folder}/{lang}.marshal".format(folder=self.__snapshot_folder, lang=self.lang_name)
+
+    def __stat_sources(self) -> list:
+        sources = []
+        for lang_file in self.__lang_load_list:
+            try:
+                stat = os.stat(lang_file)
+            except OSError:
+                sources.append([lang_file, None, None])
+            else:
+                sources.append([lang_file, stat.st_mtime_ns, stat.st_size])
+        return sources
+
+    def __load_sources(self) -> bool:
         self.__logger.info("Loading languages: {0}".format(", ".join(self.__lang_load_list)))
+        clean = True
+        table = {}
         for lang_file in self.__lang_load_list:
             try:
                 with open(lang_file, "r", encoding='utf8') as fs:
-                    self.__lang.update(json.load(fs))
+                    table.update(json.load(fs))
             except FileNotFoundError:
                 self.__logger.warning("{lang} not found, some string may not work.".format(lang=lang_file))
+                clean = False
             except json.decoder.JSONDecodeError as e:
                 self.__logger.error(
                     "Error when loading {lang} and skipped, some string may not work.".format(lang=lang_file))
                 self.__logger.error(str(e))
+                clean = False
                 continue
+        table = _share(table)
+        self.__lang.update(table)
+        self.__table = table
+        return clean
+
+    def __load_snapshot(self, sources: list) -> bool:
+        try:
+            with open(self.snapshot_path, "rb") as fs:
+                snapshot = marshal.loads(fs.read())
+        except FileNotFoundError:
+            return False
+        except (EOFError, ValueError, TypeError, OSError) as e:
+            self.__logger.warning("Language snapshot {path} is unreadable, rebuilding: {error}".format(
+                path=self.snapshot_path, error=str(e)))
+            return False
+        if type(snapshot) != dict or snapshot.get("version") != self.__snapshot_version \
+                or snapshot.get("python") != list(sys.version_info[:2]) or snapshot.get("sources") != sources:
+            return False
+        self.__logger.info("Loading languages from snapshot: {0}".format(self.snapshot_path))
+        self.__lang.update(_share(snapshot["table"]))
+        return True
+
+    def __save_snapshot(self, sources: list):
+        snapshot = {
+            "version": self.__snapshot_version,
+            "python": list(sys.version_info[:2]),
+            "sources": sources,
+            "table": self.__table
+        }
+        # Shard workers may rebuild the same locale at once, the pid keeps their temp files apart
+        tmp_path = "{0}.{1}.tmp".format(self.snapshot_path, os.getpid())
+        try:
+            os.makedirs(self.__snapshot_folder, exist_ok=True)
+            with open(tmp_path, "wb") as fs:
+                marshal.dump(snapshot, fs)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            self.__logger.warning("Can't write language snapshot {path}: {error}".format(
+                path=self.snapshot_path, error=str(e)))
 
     def __find_lang(self, folder: str):
         for walk in os.walk(folder):
@@ -47,66 +145,48 @@ class Lang:
         else:
             return lang_id
 
-    def parse_json(self, json_data, flavor="console", default_style=""):
-        if type(json_data) != dict:
-            if flavor == "console":
-                return default_style + self.__color.format_color(str(json_data))
-            else:
-                return str(json_data)
-        text = ""
-        style_prefix = ""
-        style_suffix = ""  # todo other flavor
-        if default_style == "":
-            default_style = self.__color.DEFAULT
-        if flavor == "console":
-            if "color" in json_data:
-                style_prefix += self.__color.get_color_from_string(json_data['color'].upper())
-            else:
-                style_prefix += default_style
-            if "bold" in json_data:
-                if json_data['bold']:
-                    style_prefix += self.__color.BOLD
-            if "italic" in json_data:
-                if json_data['italic']:
-                    style_prefix += self.__color.ITALIC
-            if "underlined" in json_data:
-                if json_data['underlined']:
-                    style_prefix += self.__color.UNDERLINE
-            if "strikethrough" in json_data:
-                if json_data['strikethrough']:
-                    style_prefix += self.__color.STRIKE_THROUGH
-            style_suffix += self.__color.CONSOLE_RESET
-        if "translate" in json_data:
-            if json_data["translate"] in self.__lang:
-                text = style_prefix + self.__lang[json_data["translate"]] + style_suffix
-                if 'with' in json_data:
-                    with_text = []
-                    for i in json_data['with']:
-                        with_text.append(style_suffix + self.parse_json(i, default_style=style_prefix) + style_prefix)
-                    if "%1$s" in text:
-                        tmp_num = 1
-                        while True:
-                            tmp_str = "%{0}$s".format(str(tmp_num))
-                            tmp_str_to_replace = "{" + str(tmp_num - 1) + "}"
-                            if tmp_str in text:
-                                text = text.replace(tmp_str, tmp_str_to_replace)
-                            else:
-                                break
-                            tmp_num += 1
-                        text = text.format(*with_text)
-                    while len(with_text) > text.count("%s"):
-                        with_text.pop()
-                    text = text % tuple(with_text)
-            else:
-                text = style_prefix + json_data["translate"] + style_suffix
-        elif "text" in json_data:
-            text = style_prefix + json_data["text"] + style_suffix
-        elif "score" in json_data:
-            text = style_prefix + json_data['score']['value'] + style_suffix
-        if "extra" in json_data:
-            for i in json_data["extra"]:
-                text += self.parse_json(i, default_style=style_prefix)
-        return text
+    def parse_json(self, json_data, flavor="console"):
+        return self.__renderer.render(json_data, flavor)
+
+    def parse_json_string(self, raw: str, flavor="console") -> str:
+        """Render raw chat JSON as console, plain, html or markdown; each message is tokenized only once."""
+        return self.__renderer.render_string(raw, flavor)
+
+    @property
+    def render_timing(self) -> tuple:
+        """Sampled (count, total seconds) spent in parse_json_string."""
+        return self.__renderer.render_samples, self.__renderer.render_seconds
+
+
+class LangRegistry:
+    """
+    Loads each locale once and hands the same Lang to every player using it. Locales other than
+    en_us start from a copy of the shared en_us table, so keys and untranslated values aren't duplicated.
+    """
+
+    def __init__(self, preloaded: Iterable[Lang] = (), snapshot: bool = True):
+        self.__snapshot = snapshot
+        self.__lock = threading.Lock()
+        self.__langs = {lang.lang_name: lang for lang in preloaded}  # type: Dict[str, Lang]
+
+    def get(self, lang_name: str) -> Lang:
+        with self.__lock:
+            return self.__get(lang_name)
+
+    def __get(self, lang_name: str) -> Lang:
+        lang = self.__langs.get(lang_name)
+        if lang is None:
+            fallback = None
+            if lang_name != Lang.fallback_lang:
+                fallback = self.__get(Lang.fallback_lang).translations
+            lang = Lang(lang_name, self.__snapshot, fallback)
+            self.__langs[lang_name] = lang
+        return lang
+
+    @property
+    def loaded(self) -> Dict[str, Lang]:
+        with self.__lock:
+            return dict(self.__langs)
 
 
 class Color:
@@ -133,48 +213,15 @@ class Color:
     DEFAULT = WHITE
     RESET = Style.RESET_ALL + DEFAULT
     CONSOLE_RESET = Style.RESET_ALL
-    __COLOR_CODES = {
-        "§0": RESET + BLACK,
-        "§1": RESET + DARK_BLUE,
-        "§2": RESET + DARK_GREEN,
-        "§3": RESET + DARK_AQUA,
-        "§4": RESET + DARK_RED,
-        "§5": RESET + DARK_PURPLE,
-        "§6": RESET + GOLD,
-        "§7": RESET + GRAY,
-        "§8": RESET + DARK_GRAY,
-        "§9": RESET + BLUE,
-        "§A": RESET + GREEN,
-        "§a": RESET + GREEN,
-        "§B": RESET + AQUA,
-        "§b": RESET + AQUA,
-        "§C": RESET + RED,
-        "§c": RESET + RED,
-        "§D": RESET + LIGHT_PURPLE,
-        "§d": RESET + LIGHT_PURPLE,
-        "§E": RESET + YELLOW,
-        "§e": RESET + YELLOW,
-        "§F": RESET + WHITE,
-        "§f": RESET + WHITE,
-        "§L": BOLD,
-        "§l": BOLD,
-        "§M": STRIKE_THROUGH,
-        "§m": STRIKE_THROUGH,
-        "§N": UNDERLINE,
-        "§n": UNDERLINE,
-        "§O": ITALIC,
-        "§o": ITALIC,
-        "§R": RESET,
-        "§r": RESET,
-        "§K": "",
-        "§k": ""
-    }
+
+    def __init__(self):
+        self.__console = ConsoleBackend(self)
 
     def format_color(self, text: str) -> str:
-        tmp_text = text
-        for color in self.__COLOR_CODES:
-            tmp_text.replace(color, self.__COLOR_CODES[color])
-        return tmp_text
+        """Render § formatting codes as ANSI escapes."""
+        spans = []
+        split_codes(text, DEFAULT_STYLE, spans)
+        return self.__console.render(spans)
 
     def get_color_from_string(self, color: str) -> str:
         return getattr(self, color)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import player as player_module
+from benchmark import FakeAuthenticationToken
+from chat import ChatAggregator
+from config import Config
+from events import HealthEvents
+from fakeserver import FakeServer, PROTOCOL
+from lang import Lang
+from player import Player
+from ratelimit import TokenBucket
+from reconnect import ReconnectGate
+from scheduler import Scheduler
+from tokens import TokenStore
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as fs:
+            return int(fs.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak rather than current, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(samples: List[float]) -> dict:
+    if len(samples) == 0:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(ratio: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "p50": pick(0.5),
+        "p90": pick(0.9),
+        "p99": pick(0.99),
+        "max": ordered[-1]
+    }
+
+
+class ProbePlayer(Player):
+    """A Player that timestamps its JoinGame and the echo of its own probe messages."""
+
+    def __init__(self, *args, **kwargs):
+        self.started = time.monotonic()
+        self.joined = None  # type: Optional[float]
+        self.join_event = threading.Event()
+        self.probes = {}  # type: Dict[str, float]
+        self.round_trips = []  # type: List[float]
+        Player.__init__(self, *args, **kwargs)
+
+    def handle_join_game(self, join_game_packet):
+        if self.joined is None:
+            self.joined = time.monotonic()
+        Player.handle_join_game(self, join_game_packet)
+        self.join_event.set()
+
+    def send_probe(self, token: str):
+        self.probes[token] = time.monotonic()
+        self.chat(token)
+
+    def print_chat(self, chat_packet):
+        now = time.monotonic()
+        for token in list(self.probes):
+            if '"{0}"'.format(token) in chat_packet.json_data:
+                self.round_trips.append(now - self.probes.pop(token))
+        Player.print_chat(self, chat_packet)
+
+
+def run(args) -> dict:
+    player_module.authentication.AuthenticationToken = FakeAuthenticationToken
+    config = Config(testing=True)
+    lang = Lang(config.lang)
+    scheduler = Scheduler()
+    server = None
+    if args.server:
+        host, _, port = args.server.rpartition(":")
+        address, port = host, int(port)
+    else:
+        server = FakeServer(port=0, keep_alive_interval=args.keep_alive)
+        server.start()
+        address, port = server.host, server.port
+
+    data_folder = tempfile.mkdtemp(prefix="loadtest-")
+    token_store = TokenStore(os.path.join(data_folder, "data.json"))
+    gate = ReconnectGate(address, port, config.reconnect, scheduler)
+    aggregator = ChatAggregator(lang, float(config.chat["dedup_window"]))
+    health_events = HealthEvents(lang, scheduler, config.health)
+    outbound = dict(config.outbound, queue_size=1000, messages_per_second=0)
+    connect_limit = TokenBucket(args.rate)
+
+    threads_before = threading.active_count()
+    rss_before = rss_bytes()
+
+    def start(index: int) -> ProbePlayer:
+        connect_limit.acquire()
+        return ProbePlayer(
+            account="bot{0}@loadtest".format(index),
+            password="",
+            server_address=address,
+            port=port,
+            version=PROTOCOL,
+            auto_reconnect=False,
+            auto_respawn=True,
+            lang=lang,
+            token_store=token_store,
+            outbound=outbound,
+            scheduler=scheduler,
+            reconnect_gate=gate,
+            chat_aggregator=aggregator,
+            health_events=health_events
+        )
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="LoadTest") as executor:
+        players = list(executor.map(start, range(args.bots)))
+    deadline = time.monotonic() + args.timeout
+    for player in players:
+        player.join_event.wait(max(0.0, deadline - time.monotonic()))
+    joined = [player for player in players if player.joined is not None]
+    startup_time = time.monotonic() - start_time
+    time.sleep(args.settle)
+
+    threads_after = threading.active_count()
+    rss_after = rss_bytes()
+
+    for chat_round in range(args.chat_rounds):
+        for index, player in enumerate(joined):
+            player.send_probe("probe-{0}-{1}".format(chat_round, index))
+        round_deadline = time.monotonic() + args.timeout
+        while time.monotonic() < round_deadline and any(len(player.probes) > 0 for player in joined):
+            time.sleep(0.05)
+
+    connect_times = [player.joined - player.started for player in joined]
+    round_trips = [rtt for player in joined for rtt in player.round_trips]
+    lost = sum(len(player.probes) for player in joined)
+    bots = max(len(players), 1)
+    report = {
+        "bots": len(players),
+        "joined": len(joined),
+        "startup_seconds": startup_time,
+        "connect_seconds": percentiles(connect_times),
+        "chat_round_trip_seconds": percentiles(round_trips),
+        "chat_lost": lost,
+        "memory_bytes_per_bot": (rss_after - rss_before) / bots,
+        "threads_per_bot": (threads_after - threads_before) / float(bots),
+        "threads_total": threads_after
+    }
+
+    for player in players:
+        player.disconnect()
+    if server is not None:
+        server.stop()
+    return report
+
+
+def print_report(report: dict):
+    print("Bots joined:        {joined}/{bots} in {time:.2f}s".format(
+        joined=report["joined"], bots=report["bots"], time=report["startup_seconds"]))
+    for title, key in (("Connect time", "connect_seconds"), ("Chat round trip", "chat_round_trip_seconds")):
+        stats = report[key]
+        if len(stats) == 0:
+            print("{0:<20}no samples".format(title + ":"))
+            continue
+        print("{title:<20}p50={p50:.1f}ms p90={p90:.1f}ms p99={p99:.1f}ms max={max:.1f}ms (n={count})".format(
+            title=title + ":",
+            p50=stats["p50"] * 1000,
+            p90=stats["p90"] * 1000,
+            p99=stats["p99"] * 1000,
+            max=stats["max"] * 1000,
+            count=stats["count"]
+        ))
+    print("Chat lost:          {0}".format(report["chat_lost"]))
+    print("Memory per bot:     {0:.1f} KiB".format(report["memory_bytes_per_bot"] / 1024))
+    print("Threads per bot:    {0:.2f} ({1} total)".format(report["threads_per_bot"], report["threads_total"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start many players against a local fake server and measure them")
+    parser.add_argument("--bots", type=int, default=100, help="number of players (default: 100)")
+    parser.add_argument("--rate", type=float, default=50.0, help="connects per second, 0 for no limit (default: 50)")
+    parser.add_argument("--concurrency", type=int, default=16, help="players started at once (default: 16)")
+    parser.add_argument("--chat-rounds", type=int, default=3, help="rounds of one probe message per bot (default: 3)")
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to idle before measuring (default: 2)")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="seconds to wait for joins and echoes (default: 60)")
+    parser.add_argument("--keep-alive", type=float, default=10.0, help="fake server keepalive interval (default: 10)")
+    parser.add_argument("--server", help="host:port of an already running server instead of an in-process one")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.root.setLevel(logging.WARNING)
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,11 @@ from __future__ import print_function
 
 import logging
 import os
+import queue
+import threading
 import time
-from copy import copy
 from logging import Formatter
+from typing import List
 
 from colorama import init, Fore, Style, Back
 
@@ -14,7 +16,7 @@ from colorama import init, Fore, Style, Back
 class Logger:
     __logPath = "./logs/{0}".format(time.strftime("%Y-%m-%d-%H-%M-%S"))
 
-    def __init__(self):
+    def __init__(self, capacity: int = 10000, overflow: str = "drop"):
         init(autoreset=True)
         if not os.path.isdir("./logs"):
             os.mkdir("./logs")
@@ -24,20 +26,139 @@ class Logger:
 
         # color
         colored_formatter = ColoredFormatter(self.__log_format)
-        stream = logging.StreamHandler()
+        stream = BatchedStreamHandler()
         stream.setLevel(logging.INFO)
         stream.setFormatter(colored_formatter)
 
         self.logger = logging.getLogger()
-        self.__handler = logging.FileHandler(
+        self.__handler = BatchedFileHandler(
             filename="{0}.log".format(self.__logPath),
             encoding="utf-8",
             mode="w"
         )
         self.__handler.level = logging.INFO
-        self.__handler.setFormatter(logging.Formatter(self.__log_format))
-        self.logger.addHandler(self.__handler)
-        self.logger.addHandler(stream)
+        self.__handler.setFormatter(PlainFormatter(self.__log_format))
+        self.__async_handler = AsyncHandler([self.__handler, stream], capacity=capacity, overflow=overflow)
+        self.logger.addHandler(self.__async_handler)
+
+    @property
+    def dropped(self) -> int:
+        return self.__async_handler.dropped
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Puts records on a bounded queue and leaves formatting and I/O to a dedicated thread, which writes
+    them to the wrapped handlers in batches. When the queue is full, overflow "drop" discards the new
+    record and counts it, "block" makes the logging thread wait.
+    """
+
+    __batch_size = 512
+
+    def __init__(self, handlers: List[logging.Handler], capacity: int = 10000, overflow: str = "drop"):
+        logging.Handler.__init__(self)
+        self.__handlers = handlers
+        self.__queue = queue.Queue(capacity)
+        self.__block = overflow == "block"
+        self.dropped = 0
+        self.__reported_dropped = 0
+        self.__thread = threading.Thread(target=self.__run, name="Logger", daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def prepare(record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message now since args may change after this returns; the rest is formatted later
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            record = self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if self.__block:
+            self.__queue.put(record)
+            return
+        try:
+            self.__queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def __run(self):
+        while True:
+            batch = [self.__queue.get()]
+            while len(batch) < self.__batch_size:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            dropped = self.dropped
+            if dropped != self.__reported_dropped:
+                batch.append(logging.makeLogRecord({
+                    "name": "Logger",
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "Log queue full, dropped {0} records".format(dropped - self.__reported_dropped),
+                    "threadName": self.__thread.name
+                }))
+                self.__reported_dropped = dropped
+            for handler in self.__handlers:
+                for record in batch:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                handler.flush()
+            if stop:
+                return
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+        for handler in self.__handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+
+class BatchedStreamHandler(logging.StreamHandler):
+    """StreamHandler that leaves flushing to the end of each batch."""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchedFileHandler(logging.FileHandler):
+    """FileHandler that leaves flushing to the end of each batch."""
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class PlainFormatter(Formatter):
+    """Formats a record's "plain" extra, when it has one, in place of its message, keeping ANSI out of files."""
+
+    def format(self, record):
+        plain = getattr(record, "plain", None)
+        if plain is None:
+            return Formatter.format(self, record)
+        message, args = record.msg, record.args
+        record.msg, record.args = plain, None
+        try:
+            return Formatter.format(self, record)
+        finally:
+            record.msg, record.args = message, args
 
 
 class ColoredFormatter(Formatter):
@@ -51,11 +172,18 @@ class ColoredFormatter(Formatter):
 
     def __init__(self, pattern):
         Formatter.__init__(self, pattern)
+        self.__pattern = pattern
+        self.__formatters = {}
+
+    def __formatter(self, levelname: str) -> Formatter:
+        # One formatter per level with the colored level baked into the pattern, so records aren't copied
+        formatter = self.__formatters.get(levelname)
+        if formatter is None:
+            seq = self.__mapping.get(levelname, Fore.WHITE)
+            colored_levelname = '%s[%s]%s' % (seq, levelname, Style.RESET_ALL)
+            formatter = Formatter(self.__pattern.replace("%(levelname)s", colored_levelname.replace("%", "%%")))
+            self.__formatters[levelname] = formatter
+        return formatter
 
     def format(self, record):
-        colored_record = copy(record)
-        levelname = colored_record.levelname
-        seq = self.__mapping.get(levelname, Fore.WHITE)
-        colored_levelname = '%s[%s]%s' % (seq, levelname, Style.RESET_ALL)
-        colored_record.levelname = colored_levelname
-        return Formatter.format(self, colored_record)
+        return self.__formatter(record.levelname).format(record)
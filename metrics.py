@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Callable, List, Optional
+
+
+class PlayerMetrics:
+    """
+    Counters for one player. Packets, bytes, chat and the tab list ping are only written from the
+    player's networking thread, so the hot path takes no locks. Reconnects and the connected time are
+    also updated from scheduler, console and reload threads, and go through a lock.
+    """
+
+    def __init__(self):
+        self.packets = {}
+        self.chat_received = 0
+        self.reconnects = 0
+        self.bytes_received = 0
+        self.tab_ping_seconds = None  # type: Optional[float]
+        self.__connected_since = None  # type: Optional[float]
+        self.__connected_total = 0.0
+        self.__lock = threading.Lock()
+
+    def count_packet(self, packet):
+        name = type(packet).__name__
+        self.packets[name] = self.packets.get(name, 0) + 1
+
+    def count_reconnect(self):
+        with self.__lock:
+            self.reconnects += 1
+
+    def connected(self):
+        with self.__lock:
+            if self.__connected_since is None:
+                self.__connected_since = time.monotonic()
+
+    def disconnected(self):
+        with self.__lock:
+            since = self.__connected_since
+            if since is not None:
+                self.__connected_since = None
+                self.__connected_total += time.monotonic() - since
+
+    @property
+    def is_connected(self) -> bool:
+        return self.__connected_since is not None
+
+    @property
+    def connected_seconds(self) -> float:
+        """Time connected in the current session, 0 when disconnected."""
+        since = self.__connected_since
+        return time.monotonic() - since if since is not None else 0.0
+
+    @property
+    def connected_total(self) -> float:
+        with self.__lock:
+            since = self.__connected_since
+            return self.__connected_total + (time.monotonic() - since if since is not None else 0.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text(players: list, render_timing: tuple, sinks: list = ()) -> str:
+    """Render fleet metrics in the Prometheus text exposition format."""
+    players = [player for player in players if player.authenticated]
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: List[tuple]):
+        lines.append("# HELP {0} {1}".format(name, help_text))
+        lines.append("# TYPE {0} {1}".format(name, kind))
+        for labels, value in samples:
+            label_text = ",".join('{0}="{1}"'.format(key, _escape(str(label))) for key, label in labels)
+            lines.append("{0}{{{1}}} {2}".format(name, label_text, value) if label_text else
+                         "{0} {1}".format(name, value))
+
+    metric("mcbot_packets_received_total", "counter", "Packets received by type.", [
+        ((("bot", player.username), ("type", packet)), count)
+        for player in players for packet, count in sorted(player.metrics.packets.items())
+    ])
+    metric("mcbot_bytes_received_total", "counter", "Bytes read from the server since joining the game.", [
+        ((("bot", player.username),), player.metrics.bytes_received) for player in players
+    ])
+    metric("mcbot_chat_received_total", "counter", "Chat messages received.", [
+        ((("bot", player.username),), player.metrics.chat_received) for player in players
+    ])
+    metric("mcbot_chat_sent_total", "counter", "Chat messages sent.", [
+        ((("bot", player.username),), player.chat_queue.sent) for player in players
+    ])
+    metric("mcbot_chat_dropped_total", "counter", "Outbound chat messages dropped because the queue was full.", [
+        ((("bot", player.username),), player.chat_queue.dropped) for player in players
+    ])
+    metric("mcbot_outbound_backlog", "gauge", "Chat messages waiting in the outbound queue.", [
+        ((("bot", player.username),), player.chat_queue.depth) for player in players
+    ])
+    metric("mcbot_reconnects_total", "counter", "Reconnect attempts.", [
+        ((("bot", player.username),), player.metrics.reconnects) for player in players
+    ])
+    metric("mcbot_connected", "gauge", "1 while the bot is in game.", [
+        ((("bot", player.username),), int(player.metrics.is_connected)) for player in players
+    ])
+    metric("mcbot_connected_seconds_total", "counter", "Time spent in game.", [
+        ((("bot", player.username),), "{0:.3f}".format(player.metrics.connected_total)) for player in players
+    ])
+    metric("mcbot_tab_ping_seconds", "gauge", "Latency the server lists for the bot in the tab list.", [
+        ((("bot", player.username),), player.metrics.tab_ping_seconds)
+        for player in players if player.metrics.tab_ping_seconds is not None
+    ])
+    metric("mcbot_sink_delivered_total", "counter", "Chat records delivered by each sink.", [
+        ((("sink", sink.name), ("type", sink.kind)), sink.delivered) for sink in sinks
+    ])
+    metric("mcbot_sink_dropped_total", "counter", "Chat records a sink dropped, queue full or out of retries.", [
+        ((("sink", sink.name), ("type", sink.kind)), sink.dropped) for sink in sinks
+    ])
+    metric("mcbot_sink_failures_total", "counter", "Failed sink deliveries, retries included.", [
+        ((("sink", sink.name), ("type", sink.kind)), sink.failures) for sink in sinks
+    ])
+    metric("mcbot_sink_backlog", "gauge", "Chat records waiting for a sink.", [
+        ((("sink", sink.name), ("type", sink.kind)), sink.backlog) for sink in sinks
+    ])
+    metric("mcbot_sink_lag_seconds", "gauge", "Age of the oldest record a sink hasn't delivered yet.", [
+        ((("sink", sink.name), ("type", sink.kind)), "{0:.3f}".format(sink.lag)) for sink in sinks
+    ])
+    samples, seconds = render_timing
+    metric("mcbot_render_seconds", "summary", "Sampled time spent rendering chat JSON.", [])
+    lines.append("mcbot_render_seconds_sum {0:.6f}".format(seconds))
+    lines.append("mcbot_render_seconds_count {0}".format(samples))
+    return "\n".join(lines) + "\n"
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves prometheus_text on GET /metrics from a background thread."""
+
+    def __init__(self, host: str, port: int, render: Callable[[], str]):
+        self.__logger = logging.getLogger("Metrics")
+        logging.basicConfig(level=logging.INFO)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # noinspection PyShadowingBuiltins
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = _ThreadingHTTPServer((host, port), Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="Metrics", daemon=True)
+        self.__thread.start()
+        self.__logger.info("Serving metrics on http://{host}:{port}/metrics".format(
+            host=host, port=self.__server.server_address[1]))
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+from ratelimit import TokenBucket
+
+
+class ChatQueue:
+    """A bounded outbound chat queue for one player, drained by its own sender thread under rate limits."""
+
+    def __init__(self,
+                 name: str,
+                 send: Callable[[str], None],
+                 size: int,
+                 limit: TokenBucket,
+                 global_limit: Optional[TokenBucket] = None):
+        self.__logger = logging.getLogger(name)
+        self.__name = name
+        self.__send = send
+        self.__size = size
+        self.__limit = limit
+        self.__global_limit = global_limit
+        self.__queue = deque()
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.__queue)
+
+    def put(self, text: str) -> bool:
+        """Queue a message without blocking, returns False if the queue is full and the message was dropped."""
+        with self.__condition:
+            if len(self.__queue) >= self.__size:
+                self.dropped += 1
+                return False
+            self.__queue.append(text)
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__send_loop,
+                    name="ChatSender-{0}".format(self.__name),
+                    daemon=True
+                )
+                self.__thread.start()
+            self.__condition.notify()
+        return True
+
+    def clear(self) -> int:
+        with self.__condition:
+            count = len(self.__queue)
+            self.__queue.clear()
+            self.dropped += count
+        return count
+
+    def close(self) -> int:
+        """
+        Drop what is queued and stop the sender thread, e.g. when the connection goes away. A later put
+        starts a new sender, so the queue works again after a reconnect.
+        """
+        with self.__condition:
+            count = len(self.__queue)
+            self.__queue.clear()
+            self.dropped += count
+            self.__thread = None
+            self.__condition.notify_all()
+        return count
+
+    def __send_loop(self):
+        current = threading.current_thread()
+        while True:
+            with self.__condition:
+                while len(self.__queue) == 0 and self.__thread is current:
+                    self.__condition.wait()
+                if self.__thread is not current:
+                    return
+            self.__limit.acquire()
+            if self.__global_limit is not None:
+                self.__global_limit.acquire()
+            with self.__condition:
+                if self.__thread is not current:
+                    return
+                if len(self.__queue) == 0:
+                    continue
+                text = self.__queue.popleft()
+            try:
+                self.__send(text)
+            except Exception as e:
+                self.failed += 1
+                self.__logger.error("{type}: {message}".format(type=type(e), message=str(e)))
+            else:
+                self.sent += 1
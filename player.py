@@ -5,15 +5,56 @@ from __future__ import print_function
 import base64
 import json
 import logging
-import threading
+from typing import Optional
 
 from minecraft import authentication
 from minecraft.exceptions import LoginDisconnect, YggdrasilError
 from minecraft.networking.connection import Connection
-from minecraft.networking.packets import clientbound, serverbound
+from minecraft.networking.packets import Packet, clientbound, serverbound
 from minecraft.networking.types import AbsoluteHand
 
+from capture import PacketCapture
+from chat import ChatAggregator
+from events import HealthEvents
 from lang import Lang
+from metrics import PlayerMetrics
+from outbound import ChatQueue
+from ratelimit import TokenBucket
+from reconnect import ReconnectGate
+from scheduler import ScheduledTask, Scheduler
+from tokens import SessionRefresher, TokenStore
+from tracing import StartupTracer, traced
+
+# Packets a chat-only bot still decodes: what our listeners read plus what pyCraft's play reactor answers itself
+CHAT_ONLY_PACKETS = (
+    clientbound.play.JoinGamePacket,
+    clientbound.play.ChatMessagePacket,
+    clientbound.play.DisconnectPacket,
+    clientbound.play.UpdateHealthPacket,
+    clientbound.play.PlayerListItemPacket,
+    clientbound.play.KeepAlivePacket,
+    clientbound.play.PlayerPositionAndLookPacket,
+    clientbound.play.SetCompressionPacket
+)
+
+
+class _CountingReader:
+    """Wraps the connection's input stream to add every byte read to PlayerMetrics.bytes_received."""
+
+    def __init__(self, stream, metrics: PlayerMetrics):
+        self.stream = stream
+        self.__metrics = metrics
+
+    def read(self, length: int) -> bytes:
+        data = self.stream.read(length)
+        self.__metrics.bytes_received += len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.stream.fileno()
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
 
 
 class Player:
@@ -27,24 +68,56 @@ class Player:
                  version: int,
                  auto_reconnect: bool,
                  auto_respawn: bool,
-                 lang: Lang):
+                 lang: Lang,
+                 token_store: TokenStore,
+                 outbound: dict,
+                 scheduler: Scheduler,
+                 reconnect_gate: ReconnectGate,
+                 chat_aggregator: ChatAggregator,
+                 global_chat_limit: TokenBucket = None,
+                 capture: Optional[PacketCapture] = None,
+                 chat_only: bool = False,
+                 session_ttl: float = 0,
+                 health_events: Optional[HealthEvents] = None,
+                 tracer: Optional[StartupTracer] = None,
+                 session_refresher: Optional[SessionRefresher] = None):
         self.__email = account
         self.__password = base64.b64encode(password.encode())
         self.__lang = lang
+        self.__token_store = token_store
+        self.__scheduler = scheduler
+        self.__reconnect_gate = reconnect_gate
+        self.__chat_aggregator = chat_aggregator
+        self.__capture = capture
+        self.__chat_only = chat_only
+        self.__session_ttl = session_ttl
+        self.__health_events = health_events
+        self.__tracer = tracer
+        self.__session_refresher = session_refresher
+        self.metrics = PlayerMetrics()
+        self.__reconnect_task = None  # type: Optional[ScheduledTask]
 
         self.__logger = logging.getLogger("Auth")
         logging.basicConfig(level=logging.INFO)
 
-        tokens = self.__get_tokens()
+        tokens = self.__token_store.get(self.__email)
         self.__auth = authentication.AuthenticationToken(
             username=self.__email,
             access_token=tokens["access"],
             client_token=tokens["client"]
         )
-        self.auth()
+        with traced(self.__tracer, "auth", "account", email=self.__email):
+            self.auth()
 
         self.__auto_reconnect = auto_reconnect
         self.__auto_respawn = auto_respawn
+        self.__chat_queue = ChatQueue(
+            name=self.__email,
+            send=self.__send_chat,
+            size=int(outbound["queue_size"]),
+            limit=TokenBucket(float(outbound["messages_per_second"]), float(outbound["burst"])),
+            global_limit=global_chat_limit
+        )
         self.__connection = Connection(
             address=server_address,
             port=port,
@@ -57,54 +130,57 @@ class Player:
 
         self.__logger = logging.getLogger(self.username)
 
+        self.__connection.register_packet_listener(self.metrics.count_packet, Packet, early=True)
+        if self.__capture is not None:
+            self.__connection.register_packet_listener(
+                self.__capture_packet,
+                clientbound.play.JoinGamePacket,
+                clientbound.play.ChatMessagePacket,
+                clientbound.play.DisconnectPacket,
+                clientbound.play.UpdateHealthPacket,
+                early=True
+            )
         self.__connection.register_packet_listener(self.handle_join_game, clientbound.play.JoinGamePacket)
         self.__connection.register_packet_listener(self.print_chat, clientbound.play.ChatMessagePacket)
         self.__connection.register_packet_listener(self.handle_disconnect, clientbound.play.DisconnectPacket)
         self.__connection.register_packet_listener(self.handle_health_change, clientbound.play.UpdateHealthPacket)
+        self.__connection.register_packet_listener(self.handle_player_list, clientbound.play.PlayerListItemPacket)
         self.__connection.register_exception_handler(self.handle_exception)
+        if self.__tracer is not None:
+            self.__tracer.begin(("join", self.__email), "join", email=self.__email)
         try:
-            self.__connection.connect()
+            with traced(self.__tracer, "connect", "account", email=self.__email):
+                self.__connection.connect()
         except Exception as e:
+            if self.__tracer is not None:
+                self.__tracer.end(("join", self.__email), error=str(e))
             self.__logger.error(str(e))
             self.__retry()
 
     # def connect(self, ip, port):
     #     self.__init(self.username Connection)
 
-    def __get_tokens(self) -> dict:
-        try:
-            with open('./data.json', 'r') as fs:
-                auth = json.load(fs)
-        except FileNotFoundError:
-            return {
-                "access": None,
-                "client": None
-            }
-        else:
-            if self.__email in auth:
-                return auth[self.__email]
-            else:
-                return {
-                    "access": None,
-                    "client": None
-                }
+    @property
+    def email(self) -> str:
+        return self.__email
 
-    def __refresh_tokens(self, access: str, client: str):
-        auth = {}
-        try:
-            with open('./data.json', 'r') as fs:
-                auth = json.load(fs)
-        except FileNotFoundError:
-            pass
-        finally:
-            auth[self.__email] = {
-                "access": access,
-                "client": client
-            }
-            with open('./data.json', 'w') as fs:
-                json.dump(auth, fs, indent=2)
+    @property
+    def lang(self) -> Lang:
+        """The account's locale, sent to the server and used for everything this player logs."""
+        return self.__lang
+
+    @property
+    def authenticated(self) -> bool:
+        return self.__auth.authenticated
 
-    def auth(self):
+    def auth(self, force: bool = False):
+        """Make the session usable: reuse one validated within session_ttl, else refresh, else log in."""
+        if not force and self.__restore_session():
+            self.__logger.info(self.__lang.lang("main.auth.cached").format(
+                email=self.__email,
+                age="{0:.0f}".format(self.__token_store.age(self.__email))
+            ))
+            return
         try:
             self.__auth.refresh()
         except YggdrasilError:
@@ -113,7 +189,32 @@ class Player:
             self.__login()
         else:
             self.__logger.info(self.__lang.lang("main.auth.still_valid").format(email=self.__email))
-            self.__refresh_tokens(access=self.__auth.access_token, client=self.__auth.client_token)
+            self.__save_session()
+
+    def __restore_session(self) -> bool:
+        if not self.__token_store.fresh(self.__email, self.__session_ttl):
+            return False
+        profile = self.__token_store.get(self.__email)["profile"]
+        self.__auth.profile.id_ = profile["id"]
+        self.__auth.profile.name = profile["name"]
+        return self.__auth.authenticated
+
+    def __save_session(self):
+        profile = self.__auth.profile
+        self.__token_store.update(
+            self.__email,
+            access=self.__auth.access_token,
+            client=self.__auth.client_token,
+            profile={"id": getattr(profile, "id_", None), "name": profile.name} if profile is not None else None
+        )
+
+    def refresh_session(self):
+        """Renew the tokens off the networking thread, so a later join doesn't wait for the auth server."""
+        self.auth(force=True)
+
+    def __reauthenticate(self):
+        self.auth(force=True)
+        self.__schedule_reconnect(1.0)
 
     def __login(self):
         self.__logger.info(self.__lang.lang("main.auth.login").format(email=self.__email))
@@ -125,15 +226,23 @@ class Player:
         except YggdrasilError as e:
             self.__logger.error(self.__lang.lang("main.auth.error").format(email=self.__email, message=str(e)))
         else:
-            self.__refresh_tokens(access=self.__auth.access_token, client=self.__auth.client_token)
+            self.__save_session()
 
     def reconnect(self):
+        self.__cancel_reconnect()
+        if not self.__reconnect_gate.admit(self):
+            self.__schedule_reconnect(self.__reconnect_gate.admission_delay())
+            return
+        self.metrics.count_reconnect()
         try:
             self.__connection.connect()
         except Exception as e:
             self.__logger.error(str(e))
             self.__retry()
 
+    def __capture_packet(self, packet):
+        self.__capture.write(self.username, packet)
+
     # noinspection PyUnusedLocal
     def handle_join_game(self, join_game_packet):
         self.__logger.info(self.__lang.lang("player.connected").format(
@@ -141,52 +250,91 @@ class Player:
             port=self.__connection.options.port
         ))
         self.__retries = 0
+        self.__reconnect_gate.release(self)
+        self.metrics.connected()
+        self.__chat_aggregator.joined(self.username)
+        if self.__tracer is not None:
+            # From connect() through login to the first JoinGame, closed on the networking thread
+            self.__tracer.end(("join", self.__email))
+        self.__wrap_stream()
         packet = serverbound.play.ClientSettingsPacket()
         packet.locale = self.__lang.lang_name
-        packet.view_distance = 10
+        packet.view_distance = 2 if self.__chat_only else 10
         packet.chat_mode = packet.ChatMode.FULL
         packet.chat_colors = False
         packet.displayed_skin_parts = packet.SkinParts.ALL
         packet.main_hand = AbsoluteHand.RIGHT
         self.__connection.write_packet(packet)
 
+    def __wrap_stream(self):
+        # JoinGame is read on the networking thread before the next packet, so swapping the stream and the
+        # reactor's packet table here takes effect for everything the server sends in this session
+        stream = self.__connection.file_object
+        if stream is not None and not isinstance(stream, _CountingReader):
+            self.__connection.file_object = _CountingReader(stream, self.metrics)
+        reactor = self.__connection.reactor
+        if self.__chat_only and reactor is not None:
+            # Unknown ids are returned as bare Packets without being parsed, so chunks and entities cost
+            # only their decompression
+            reactor.clientbound_packets = {
+                packet_id: packet for packet_id, packet in reactor.clientbound_packets.items()
+                if packet in CHAT_ONLY_PACKETS
+            }
+
     def print_chat(self, chat_packet):
-        self.__logger.info("[{position}] {message}".format(
-            position=chat_packet.field_string('position'),
-            message=self.__lang.parse_json(json.loads(chat_packet.json_data))
-        ))
+        self.metrics.chat_received += 1
+        self.__chat_aggregator.receive(self.username, self.__logger, chat_packet, self.__lang)
 
     def handle_disconnect(self, disconnect_packet):
+        self.metrics.disconnected()
+        self.__chat_aggregator.left(self.username)
         self.__logger.warning(
             self.__lang.lang("player.connection.lost").format(
-                reason=self.__lang.parse_json(json.loads(disconnect_packet.json_data))))
+                reason=self.__lang.parse_json_string(disconnect_packet.json_data)))
         if self.__auto_reconnect:
             self.__retry()
 
     def handle_health_change(self, health_packet):
-        self.__logger.warning(self.__lang.lang("player.health.changed").format(
-            health=str(health_packet.health),
-            food=str(health_packet.food),
-            saturation=str(health_packet.food_saturation)))
+        if self.__health_events is not None:
+            self.__health_events.update(self.username, self.__logger, health_packet.health, health_packet.food,
+                                        health_packet.food_saturation, self.__lang)
+        else:
+            self.__logger.warning(self.__lang.lang("player.health.changed").format(
+                health=str(health_packet.health),
+                food=str(health_packet.food),
+                saturation=str(health_packet.food_saturation),
+                updates=1))
 
         if self.__auto_respawn and health_packet.health == 0:
             self.__logger.info(self.__lang.lang("player.respawn.hint"))
-            timer = threading.Timer(1.0, self.respawn)
-            timer.start()
+            self.__scheduler.schedule(1.0, self.respawn)
+
+    def handle_player_list(self, player_list_packet):
+        # pyCraft answers keepalives itself, so the ping the server lists for us in the tab list is what we have
+        for action in player_list_packet.actions:
+            ping = getattr(action, "ping", None)
+            if ping is not None and str(action.uuid).replace("-", "") == self.__auth.profile.id_:
+                self.metrics.tab_ping_seconds = ping / 1000.0
 
     def handle_exception(self, e, info):
+        self.metrics.disconnected()
+        self.__chat_aggregator.left(self.username)
         if type(info[1]) == LoginDisconnect:
             message = str(e).replace('The server rejected our login attempt with: "', '').replace('".', '')
             try:
                 self.__logger.error(self.__lang.lang("player.connection.rejected").format(
-                    reason=self.__lang.parse_json(json.loads(message))))
+                    reason=self.__lang.parse_json_string(message)))
             except json.decoder.JSONDecodeError:
                 self.__logger.error(self.__lang.lang("player.connection.rejected").format(reason=message))
         elif type(info[1]) == YggdrasilError:
             self.__logger.error(self.__lang.lang("player.session.expired"))
-            self.auth()
-            timer = threading.Timer(1.0, self.reconnect)
-            timer.start()
+            # Authenticating takes round trips to the auth server, keep them off the networking thread
+            self.__token_store.invalidate(self.__email)
+            if self.__session_refresher is not None:
+                # Shares the refresher's pending refresh of this account instead of logging in alongside it
+                self.__session_refresher.request(self, then=lambda: self.__schedule_reconnect(1.0))
+            else:
+                self.__scheduler.schedule(0, self.__reauthenticate)
             return
         else:
             self.__logger.error("{type}: {message}".format(type=type(info[1]), message=str(e)))
@@ -195,13 +343,33 @@ class Player:
                 self.__retry()
 
     def __retry(self):
+        self.__reconnect_gate.release(self)
         self.__retries += 1
-        if self.__retries >= 6:
+        if 0 <= self.__reconnect_gate.max_retries < self.__retries:
             self.__retries = 0
+            self.__logger.warning(self.__lang.lang("player.connection.dormant"))
+            self.__reconnect_gate.sleep(self)
             return
-        self.__logger.info(self.__lang.lang("player.connection.retry").format(times=str(self.__retries)))
-        timer = threading.Timer(5.0, self.reconnect)
-        timer.start()
+        delay = self.__reconnect_gate.backoff(self.__retries)
+        self.__logger.info(self.__lang.lang("player.connection.retry").format(
+            delay="{0:.1f}".format(delay),
+            times=str(self.__retries)
+        ))
+        self.__schedule_reconnect(delay)
+
+    def wake(self):
+        self.__logger.info(self.__lang.lang("player.connection.wake"))
+        self.__retries = 0
+        self.reconnect()
+
+    def __schedule_reconnect(self, delay: float):
+        self.__cancel_reconnect()
+        self.__reconnect_task = self.__scheduler.schedule(delay, self.reconnect)
+
+    def __cancel_reconnect(self):
+        if self.__reconnect_task is not None:
+            self.__reconnect_task.cancel()
+            self.__reconnect_task = None
 
     def respawn(self):
         packet = serverbound.play.ClientStatusPacket()
@@ -210,20 +378,43 @@ class Player:
         self.__logger.info(self.__lang.lang("player.respawned"))
 
     def disconnect(self):
+        self.__cancel_reconnect()
+        self.__reconnect_gate.forget(self)
         self.__connection.disconnect()
+        self.__chat_queue.close()
+        self.metrics.disconnected()
+        if self.authenticated:
+            # username is only known once auth succeeded, ~disconnect also reaches accounts that never logged in
+            self.__chat_aggregator.left(self.username)
+            if self.__health_events is not None:
+                self.__health_events.forget(self.username)
         self.__logger.info(self.__lang.lang("player.disconnected"))
 
-    def toggle_auto_respawn(self):
-        self.__auto_respawn = not self.__auto_respawn
+    def set_auto_respawn(self, value: bool):
+        self.__auto_respawn = value
         self.__logger.info(self.__lang.lang("player.auto_respawn.toggle").format(value=self.__auto_respawn))
 
-    def toggle_auto_reconnect(self):
-        self.__auto_reconnect = not self.__auto_reconnect
+    def toggle_auto_respawn(self):
+        self.set_auto_respawn(not self.__auto_respawn)
+
+    def set_auto_reconnect(self, value: bool):
+        self.__auto_reconnect = value
         self.__logger.info(self.__lang.lang("player.auto_reconnect.toggle").format(value=self.__auto_reconnect))
 
+    def toggle_auto_reconnect(self):
+        self.set_auto_reconnect(not self.__auto_reconnect)
+
+    @property
+    def chat_queue(self) -> ChatQueue:
+        return self.__chat_queue
+
     def chat(self, text: str):
         if text == "":
             return
+        if not self.__chat_queue.put(text):
+            self.__logger.warning(self.__lang.lang("player.chat.dropped").format(message=text))
+
+    def __send_chat(self, text: str):
         packet = serverbound.play.ChatPacket()
         packet.message = text
         self.__connection.write_packet(packet)
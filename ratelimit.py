@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        :param rate: tokens added per second, 0 or less disables the limit
+        :param capacity: maximum tokens that can be spent in a burst
+        """
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.__tokens = self.capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now: float):
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def try_acquire(self) -> bool:
+        if self.rate <= 0:
+            return True
+        with self.__lock:
+            self.__refill(time.monotonic())
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return True
+            return False
+
+    def delay(self) -> float:
+        """Seconds until a token is available, without taking it."""
+        if self.rate <= 0:
+            return 0.0
+        with self.__lock:
+            self.__refill(time.monotonic())
+            if self.__tokens >= 1:
+                return 0.0
+            return (1 - self.__tokens) / self.rate
+
+    def acquire(self):
+        while not self.try_acquire():
+            time.sleep(self.delay())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import random
+import socket
+import threading
+import time
+
+from scheduler import Scheduler
+
+
+class ReconnectGate:
+    """
+    Fleet-wide reconnect policy for one server: jittered exponential backoff, a cap on connect attempts
+    in flight at once, and a probe that wakes players that ran out of retries once the server is back.
+    """
+
+    def __init__(self, server_address: str, port: int, options: dict, scheduler: Scheduler):
+        self.__logger = logging.getLogger("Reconnect")
+        logging.basicConfig(level=logging.INFO)
+        self.__address = server_address
+        self.__port = port
+        self.__scheduler = scheduler
+        self.base_delay = float(options["base_delay"])
+        self.max_delay = float(options["max_delay"])
+        self.multiplier = float(options["multiplier"])
+        self.jitter = min(max(float(options["jitter"]), 0.0), 1.0)
+        self.max_retries = int(options["max_retries"])
+        self.max_in_flight = int(options["max_in_flight"])
+        self.attempt_timeout = float(options["attempt_timeout"])
+        self.probe_interval = float(options["probe_interval"])
+        self.wake_spread = float(options["wake_spread"])
+        self.__lock = threading.Lock()
+        self.__in_flight = {}
+        self.__dormant = set()
+        self.__probe_task = None
+
+    def retarget(self, server_address: str, port: int):
+        """Point the probe at a new server after a config reload."""
+        with self.__lock:
+            self.__address = server_address
+            self.__port = port
+
+    def backoff(self, retries: int) -> float:
+        delay = min(self.max_delay, self.base_delay * (self.multiplier ** max(retries - 1, 0)))
+        return delay * random.uniform(1 - self.jitter, 1)
+
+    def __prune(self, now: float):
+        for player, started in list(self.__in_flight.items()):
+            if now - started > self.attempt_timeout:
+                del self.__in_flight[player]
+
+    def admit(self, player) -> bool:
+        """Take a connect slot for the player, False if too many attempts are already in flight."""
+        if self.max_in_flight <= 0:
+            return True
+        now = time.monotonic()
+        with self.__lock:
+            self.__prune(now)
+            if player not in self.__in_flight and len(self.__in_flight) >= self.max_in_flight:
+                return False
+            self.__in_flight[player] = now
+            return True
+
+    def admission_delay(self) -> float:
+        return random.uniform(0.5, 1.5) * max(self.base_delay / 2, 1.0)
+
+    def release(self, player):
+        with self.__lock:
+            self.__in_flight.pop(player, None)
+
+    def sleep(self, player):
+        """Park a player that ran out of retries until the server answers a probe."""
+        with self.__lock:
+            self.__in_flight.pop(player, None)
+            self.__dormant.add(player)
+            if self.__probe_task is None:
+                self.__probe_task = self.__scheduler.schedule(self.probe_interval, self.__probe)
+
+    def forget(self, player):
+        with self.__lock:
+            self.__in_flight.pop(player, None)
+            self.__dormant.discard(player)
+
+    def __probe(self):
+        try:
+            with socket.create_connection((self.__address, self.__port), timeout=5):
+                pass
+        except OSError:
+            with self.__lock:
+                if len(self.__dormant) == 0:
+                    self.__probe_task = None
+                else:
+                    self.__probe_task = self.__scheduler.schedule(self.probe_interval, self.__probe)
+            return
+        with self.__lock:
+            players = list(self.__dormant)
+            self.__dormant.clear()
+            self.__probe_task = None
+        if len(players) > 0:
+            self.__logger.info("{address}:{port} is reachable again, waking {count} players".format(
+                address=self.__address, port=self.__port, count=len(players)))
+        for player in players:
+            self.__scheduler.schedule(random.uniform(0, self.wake_spread), player.wake)
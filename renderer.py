@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import html
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional, Tuple
+
+_POSITIONAL = re.compile(r"%([1-9]\d*)\$s")
+
+Style = namedtuple("Style", ["color", "bold", "italic", "underlined", "strikethrough", "obfuscated"])
+Span = Tuple[str, Style]
+
+DEFAULT_STYLE = Style(None, False, False, False, False, False)
+_FORMATS = ("bold", "italic", "underlined", "strikethrough", "obfuscated")
+
+# § code -> color name, format field, or None for §r
+_CODES = {
+    "0": "black", "1": "dark_blue", "2": "dark_green", "3": "dark_aqua",
+    "4": "dark_red", "5": "dark_purple", "6": "gold", "7": "gray",
+    "8": "dark_gray", "9": "blue", "a": "green", "b": "aqua",
+    "c": "red", "d": "light_purple", "e": "yellow", "f": "white",
+    "k": "obfuscated", "l": "bold", "m": "strikethrough", "n": "underlined", "o": "italic",
+    "r": None
+}
+
+# (style, code value) -> style after the code, shared by every renderer
+_TRANSITIONS = {}  # type: Dict[Tuple[Style, str], Style]
+
+_HEX = {
+    "black": "#000000", "dark_blue": "#0000AA", "dark_green": "#00AA00", "dark_aqua": "#00AAAA",
+    "dark_red": "#AA0000", "dark_purple": "#AA00AA", "gold": "#FFAA00", "gray": "#AAAAAA",
+    "dark_gray": "#555555", "blue": "#5555FF", "green": "#55FF55", "aqua": "#55FFFF",
+    "red": "#FF5555", "light_purple": "#FF55FF", "yellow": "#FFFF55", "white": "#FFFFFF"
+}
+
+_HEX_COLOR = re.compile(r"#[0-9a-f]{6}")
+_MARKDOWN_SPECIAL = re.compile(r"([\\`*_~\[\]<>|#])")
+
+
+def split_codes(text: str, base: Style, spans: List[Span]):
+    """Append text to spans, applying § formatting codes in one pass; §r returns to base."""
+    if "§" not in text:
+        if text:
+            spans.append((text, base))
+        return
+    style = base
+    start = 0
+    position = text.find("§")
+    while position >= 0:
+        code = text[position + 1:position + 2].lower()
+        if code == "" or code not in _CODES:
+            # Unknown codes and a trailing § stay in the text
+            position = text.find("§", position + 1)
+            continue
+        if position > start:
+            spans.append((text[start:position], style))
+        value = _CODES[code]
+        if value is None:
+            style = base
+        else:
+            key = (style, value)
+            following = _TRANSITIONS.get(key)
+            if following is None:
+                if value in _FORMATS:
+                    following = style._replace(**{value: True})
+                else:
+                    following = DEFAULT_STYLE._replace(color=value)
+                _TRANSITIONS[key] = following
+            style = following
+        start = position + 2
+        position = text.find("§", start)
+    if start < len(text):
+        spans.append((text[start:], style))
+
+
+def _plain(text: str) -> bool:
+    """Whether text can be spliced without the % and str.format passes ever seeing it."""
+    return "%" not in text and "{" not in text and "}" not in text
+
+
+class _Template:
+    """
+    A translation template split once into literal pieces around its placeholders.
+
+    Templates the splitter can't reproduce exactly (stray %, braces, gaps in %n$s numbering) keep
+    pieces as None and are rendered by the original replace/format/% passes on the arguments' plain text.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self.positional = "%1$s" in template
+        self.pieces = None  # type: Optional[List[str]]
+        self.indexes = None  # type: Optional[List[int]]
+        if self.positional:
+            parts = _POSITIONAL.split(template)
+            pieces = parts[0::2]
+            indexes = [int(i) - 1 for i in parts[1::2]]
+            if all(_plain(piece) for piece in pieces) and set(indexes) == set(range(max(indexes) + 1)):
+                self.pieces = pieces
+                self.indexes = indexes
+        else:
+            pieces = template.split("%s")
+            if all(_plain(piece) for piece in pieces):
+                self.pieces = pieces
+
+    def tokenize(self, style: Style, with_spans: List[List[Span]], spans: List[Span]):
+        pieces = self.pieces
+        if pieces is not None:
+            if self.positional:
+                if len(with_spans) > max(self.indexes):
+                    split_codes(pieces[0], style, spans)
+                    for index, piece in zip(self.indexes, pieces[1:]):
+                        spans.extend(with_spans[index])
+                        split_codes(piece, style, spans)
+                    return
+            elif len(with_spans) >= len(pieces) - 1:
+                split_codes(pieces[0], style, spans)
+                for arg, piece in zip(with_spans, pieces[1:]):
+                    spans.extend(arg)
+                    split_codes(piece, style, spans)
+                return
+        with_text = ["".join(text for text, _ in arg) for arg in with_spans]
+        split_codes(self.__format_slow(self.template, with_text), style, spans)
+
+    @staticmethod
+    def __format_slow(text: str, with_text: List[str]) -> str:
+        if "%1$s" in text:
+            tmp_num = 1
+            while True:
+                tmp_str = "%{0}$s".format(str(tmp_num))
+                tmp_str_to_replace = "{" + str(tmp_num - 1) + "}"
+                if tmp_str in text:
+                    text = text.replace(tmp_str, tmp_str_to_replace)
+                else:
+                    break
+                tmp_num += 1
+            text = text.format(*with_text)
+        with_text = list(with_text)
+        while len(with_text) > text.count("%s"):
+            with_text.pop()
+        return text % tuple(with_text)
+
+
+def _runs(spans: List[Span]) -> List[Span]:
+    """Merge neighbouring spans that share a style."""
+    runs = []
+    for text, style in spans:
+        if runs and runs[-1][1] == style:
+            runs[-1] = (runs[-1][0] + text, style)
+        else:
+            runs.append((text, style))
+    return runs
+
+
+class ConsoleBackend:
+    """ANSI escapes through colorama's codes, reset before every style change and at the end."""
+
+    def __init__(self, color):
+        self.__color = color
+        self.__prefixes = {}  # type: Dict[Style, str]
+
+    def __prefix(self, style: Style) -> str:
+        prefix = self.__prefixes.get(style)
+        if prefix is None:
+            color = self.__color
+            prefix = color.DEFAULT
+            if style.color is not None:
+                try:
+                    prefix = color.get_color_from_string(style.color.upper())
+                except AttributeError:
+                    pass
+            if style.bold:
+                prefix += color.BOLD
+            if style.italic:
+                prefix += color.ITALIC
+            if style.underlined:
+                prefix += color.UNDERLINE
+            if style.strikethrough:
+                prefix += color.STRIKE_THROUGH
+            self.__prefixes[style] = prefix
+        return prefix
+
+    def render(self, spans: List[Span]) -> str:
+        text = []
+        current = None
+        for piece, style in spans:
+            if style != current:
+                if current is not None:
+                    text.append(self.__color.CONSOLE_RESET)
+                text.append(self.__prefix(style))
+                current = style
+            text.append(piece)
+        if current is not None:
+            text.append(self.__color.CONSOLE_RESET)
+        return "".join(text)
+
+
+class PlainBackend:
+    """Text only, for log files and the archive's search index."""
+
+    @staticmethod
+    def render(spans: List[Span]) -> str:
+        return "".join(text for text, _ in spans)
+
+
+class HtmlBackend:
+    """Escaped text in <span> elements carrying the style inline."""
+
+    @staticmethod
+    def render(spans: List[Span]) -> str:
+        text = []
+        for piece, style in _runs(spans):
+            css = []
+            if style.color in _HEX:
+                css.append("color:" + _HEX[style.color])
+            elif style.color is not None and _HEX_COLOR.fullmatch(style.color):
+                css.append("color:" + style.color)
+            if style.bold:
+                css.append("font-weight:bold")
+            if style.italic:
+                css.append("font-style:italic")
+            decorations = [name for name, value in (("underline", style.underlined),
+                                                    ("line-through", style.strikethrough)) if value]
+            if decorations:
+                css.append("text-decoration:" + " ".join(decorations))
+            piece = html.escape(piece)
+            text.append('<span style="{0}">{1}</span>'.format(";".join(css), piece) if css else piece)
+        return "".join(text)
+
+
+class MarkdownBackend:
+    """Bold, italic and strikethrough as Markdown emphasis; colors and underline have no Markdown form."""
+
+    @staticmethod
+    def render(spans: List[Span]) -> str:
+        text = []
+        for piece, style in _runs(spans):
+            marker = ("**" if style.bold else "") + ("*" if style.italic else "") + \
+                     ("~~" if style.strikethrough else "")
+            stripped = piece.strip()
+            piece = _MARKDOWN_SPECIAL.sub(r"\\\1", piece)
+            if marker == "" or stripped == "":
+                text.append(piece)
+                continue
+            # Emphasis markers must touch the text, so surrounding whitespace goes outside them
+            start = len(piece) - len(piece.lstrip())
+            end = len(piece.rstrip())
+            text.append(piece[:start] + marker + piece[start:end] + marker[::-1] + piece[end:])
+        return "".join(text)
+
+
+class ChatRenderer:
+    """
+    Tokenizes chat components and § codes into styled spans once, then renders those spans with an
+    output backend per flavor: console, plain, html or markdown.
+    """
+
+    def __init__(self, translations: dict, color, cache_size: int = 4096, sample_every: int = 16):
+        self.__translations = translations
+        self.__cache_size = cache_size
+        self.__templates = {}
+        self.__styles = {}
+        self.__backends = {
+            "console": ConsoleBackend(color),
+            "plain": PlainBackend(),
+            "html": HtmlBackend(),
+            "markdown": MarkdownBackend()
+        }
+        self.__rendered = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__sample_every = sample_every
+        self.__calls = 0
+        self.render_samples = 0
+        self.render_seconds = 0.0
+
+    @property
+    def flavors(self) -> List[str]:
+        return list(self.__backends)
+
+    def clear_cache(self):
+        with self.__lock:
+            self.__templates = {}
+            self.__styles = {}
+            self.__rendered.clear()
+
+    def __template(self, key: str) -> _Template:
+        template = self.__templates.get(key)
+        if template is None:
+            template = _Template(self.__translations[key])
+            self.__templates[key] = template
+        return template
+
+    def __style(self, json_data: dict, parent: Style) -> Style:
+        key = (
+            parent,
+            json_data.get("color"),
+            json_data.get("bold"),
+            json_data.get("italic"),
+            json_data.get("underlined"),
+            json_data.get("strikethrough"),
+            json_data.get("obfuscated")
+        )
+        try:
+            style = self.__styles.get(key)
+        except TypeError:
+            # Unhashable field values are rare enough to resolve uncached
+            key = None
+            style = None
+        if style is not None:
+            return style
+        style = parent
+        color = json_data.get("color")
+        if color is not None:
+            color = str(color).lower()
+            style = style._replace(color=None if color == "reset" else color)
+        for field in _FORMATS:
+            if field in json_data:
+                style = style._replace(**{field: bool(json_data[field])})
+        if key is not None:
+            self.__styles[key] = style
+        return style
+
+    def __tokenize(self, json_data, parent: Style, spans: List[Span]):
+        if type(json_data) != dict:
+            split_codes(str(json_data), parent, spans)
+            return
+        style = self.__style(json_data, parent)
+        if "translate" in json_data:
+            if json_data["translate"] in self.__translations:
+                if 'with' in json_data:
+                    with_spans = []
+                    for i in json_data['with']:
+                        arg = []
+                        self.__tokenize(i, style, arg)
+                        with_spans.append(arg)
+                    self.__template(json_data["translate"]).tokenize(style, with_spans, spans)
+                else:
+                    split_codes(self.__translations[json_data["translate"]], style, spans)
+            else:
+                split_codes(json_data["translate"], style, spans)
+        elif "text" in json_data:
+            split_codes(json_data["text"], style, spans)
+        elif "score" in json_data:
+            split_codes(json_data['score']['value'], style, spans)
+        if "extra" in json_data:
+            for i in json_data["extra"]:
+                self.__tokenize(i, style, spans)
+
+    def tokenize(self, json_data) -> List[Span]:
+        """Flatten a chat component (or a string with § codes) into (text, Style) spans."""
+        spans = []
+        self.__tokenize(json_data, DEFAULT_STYLE, spans)
+        return spans
+
+    def __backend(self, flavor: str):
+        try:
+            return self.__backends[flavor]
+        except KeyError:
+            raise ValueError("Unknown chat flavor {0!r}, expected one of {1}".format(
+                flavor, ", ".join(self.__backends)))
+
+    def render_spans(self, spans: List[Span], flavor="console") -> str:
+        return self.__backend(flavor).render(spans)
+
+    def render(self, json_data, flavor="console") -> str:
+        return self.__backend(flavor).render(self.tokenize(json_data))
+
+    def render_string(self, raw: str, flavor="console") -> str:
+        """
+        Decode and render a raw chat JSON string. Spans and each flavor rendered from them are memoized
+        per raw string, so a repeated message or another flavor of the same one skips the earlier steps.
+        """
+        self.__calls += 1
+        if self.__sample_every > 0 and self.__calls % self.__sample_every == 0:
+            start = time.perf_counter()
+            text = self.__render_string(raw, flavor)
+            self.render_seconds += time.perf_counter() - start
+            self.render_samples += 1
+            return text
+        return self.__render_string(raw, flavor)
+
+    def __render_string(self, raw: str, flavor: str) -> str:
+        backend = self.__backend(flavor)
+        with self.__lock:
+            entry = self.__rendered.get(raw)
+            if entry is not None:
+                self.__rendered.move_to_end(raw)
+                text = entry[1].get(flavor)
+                if text is not None:
+                    return text
+        if entry is None:
+            entry = (self.tokenize(json.loads(raw)), {})
+        text = backend.render(entry[0])
+        with self.__lock:
+            entry[1][flavor] = text
+            self.__rendered[raw] = entry
+            if len(self.__rendered) > self.__cache_size:
+                self.__rendered.popitem(last=False)
+        return text
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class ScheduledTask:
+    def __init__(self, when: float, func: Callable, args: tuple):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    One timer thread shared by every player. Due tasks are handed to a small worker pool so a slow
+    callback (e.g. a reconnect blocking on the network) doesn't hold up the others.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.__logger = logging.getLogger("Scheduler")
+        logging.basicConfig(level=logging.INFO)
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Scheduler")
+        self.__thread = threading.Thread(target=self.__run, name="Scheduler", daemon=True)
+        self.__thread.start()
+
+    def schedule(self, delay: float, func: Callable, *args) -> ScheduledTask:
+        task = ScheduledTask(time.monotonic() + delay, func, args)
+        with self.__condition:
+            heapq.heappush(self.__heap, (task.when, next(self.__counter), task))
+            self.__condition.notify()
+        return task
+
+    @property
+    def pending(self) -> int:
+        with self.__condition:
+            return len([entry for entry in self.__heap if not entry[2].cancelled])
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    while len(self.__heap) > 0 and self.__heap[0][2].cancelled:
+                        heapq.heappop(self.__heap)
+                    if len(self.__heap) == 0:
+                        self.__condition.wait()
+                        continue
+                    delay = self.__heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.__condition.wait(delay)
+                task = heapq.heappop(self.__heap)[2]
+            self.__executor.submit(self.__call, task)
+
+    def __call(self, task: ScheduledTask):
+        if task.cancelled:
+            return
+        try:
+            task.func(*task.args)
+        except Exception as e:
+            self.__logger.exception("{type}: {message}".format(type=type(e), message=str(e)))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import logging.handlers
+import multiprocessing
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+from config import Config
+from lang import Lang, LangRegistry
+from tracing import StartupTracer, profiled, traced
+
+
+def shard_index(email: str, workers: int) -> int:
+    """Worker that owns an account; stable across reloads so added accounts land on exactly one worker."""
+    return zlib.crc32(email.encode("utf-8")) % workers
+
+
+def worker_main(index: int,
+                workers: int,
+                connection,
+                log_queue,
+                capture_path: Optional[str],
+                trace_path: Optional[str] = None,
+                profile_path: Optional[str] = None):
+    """Entry point of a worker process: run a ChatBot for the accounts this shard owns and take commands."""
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+    lock = threading.Lock()
+    fleet = None
+
+    def send_players():
+        with lock:
+            connection.send(("players", [player.username for player in list(fleet.players) if player.authenticated]))
+
+    tracer = StartupTracer(profile=profile_path is not None) if trace_path is not None else None
+    with profiled(tracer):
+        with traced(tracer, "import modules"):
+            from bot import ChatBot
+            from startup import start_fleet
+        with traced(tracer, "config"):
+            config = Config()
+        with traced(tracer, "lang"):
+            locales = LangRegistry()
+            lang = locales.get(config.lang)
+        fleet = start_fleet(
+            config,
+            lang,
+            owns=lambda account: shard_index(account["email"], workers) == index,
+            capture_path="{0}.{1}".format(capture_path, index) if capture_path else None,
+            metrics_port=int(config.metrics["port"]) + 1 + index,
+            on_change=send_players,
+            locales=locales,
+            tracer=tracer
+        )
+        bot = ChatBot(fleet.players, lang, fleet.archive, fleet.reloader, fleet.jobs, fleet.sinks)
+    send_players()
+    if tracer is not None:
+        tracer.report_when_joined("{0}.{1}".format(trace_path, index),
+                                  "{0}.{1}".format(profile_path, index) if profile_path else None)
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == "text":
+                bot.handle_text(message[1])
+            elif message[0] == "stop":
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    for player in fleet.players:
+        if player.authenticated:
+            player.disconnect()
+
+
+class _Worker:
+    def __init__(self, index: int, process: multiprocessing.Process, connection):
+        self.index = index
+        self.process = process
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def send(self, message: tuple):
+        with self.lock:
+            self.connection.send(message)
+
+
+class ShardManager:
+    """
+    Control plane for sharded mode: spreads accounts over worker processes by shard_index, routes console
+    input to the worker owning each player and merges worker logs back into this process's log stream.
+    """
+
+    __local_commands = ("help", "search")
+    # Every worker runs its own copy of a job for the bots it owns, so job ids stay the same across workers
+    __broadcast_commands = ("jobs", "job_start", "job_pause", "job_resume", "job_cancel")
+
+    def __init__(self,
+                 config: Config,
+                 lang: Lang,
+                 workers: int,
+                 capture_path: Optional[str] = None,
+                 trace_path: Optional[str] = None,
+                 profile_path: Optional[str] = None):
+        self.__logger = logging.getLogger("Shard")
+        self.__config = config
+        self.__lang = lang
+        self.__worker_count = workers
+        self.__capture_path = capture_path
+        self.__trace_path = trace_path
+        self.__profile_path = profile_path
+        self.__context = multiprocessing.get_context("spawn")
+        self.__log_queue = self.__context.Queue()
+        self.__workers = []  # type: List[_Worker]
+        self.__owners = {}  # type: Dict[str, _Worker]
+        self.__lock = threading.Lock()
+
+    def start(self):
+        # Workers read config.json themselves and pick their accounts with shard_index
+        accounts = [account for account in self.__config.accounts if not account["disabled"]]
+        workers = max(1, min(self.__worker_count, len(accounts)))
+        self.__logger.info(self.__lang.lang("main.shard.start").format(workers=workers, count=len(accounts)))
+        threading.Thread(target=self.__forward_logs, name="ShardLogs", daemon=True).start()
+        for index in range(workers):
+            parent, child = self.__context.Pipe()
+            process = self.__context.Process(
+                target=worker_main,
+                args=(index, workers, child, self.__log_queue, self.__capture_path, self.__trace_path,
+                      self.__profile_path),
+                name="Shard-{0}".format(index),
+                daemon=True
+            )
+            process.start()
+            worker = _Worker(index, process, parent)
+            self.__workers.append(worker)
+            threading.Thread(target=self.__read_worker, args=(worker,), name=process.name, daemon=True).start()
+
+    def __forward_logs(self):
+        while True:
+            record = self.__log_queue.get()
+            record.threadName = "{0}:{1}".format(record.processName, record.threadName)
+            logging.getLogger(record.name).handle(record)
+
+    def __read_worker(self, worker: _Worker):
+        try:
+            while True:
+                message = worker.connection.recv()
+                if message[0] == "players":
+                    with self.__lock:
+                        for username in [name for name, owner in self.__owners.items() if owner is worker]:
+                            del self.__owners[username]
+                        for username in message[1]:
+                            self.__owners[username] = worker
+                    self.__logger.info(self.__lang.lang("main.shard.ready").format(
+                        index=worker.index, count=len(message[1])))
+        except EOFError:
+            worker.process.join()
+            self.__logger.error(self.__lang.lang("main.shard.exited").format(
+                index=worker.index, code=worker.process.exitcode))
+
+    def __send(self, workers: List[_Worker], message: tuple):
+        for worker in workers:
+            try:
+                worker.send(message)
+            except (BrokenPipeError, OSError):
+                continue
+
+    def handle_text(self, text: str):
+        if not text.startswith("~"):
+            self.__send(self.__workers, ("text", text))
+            return
+        raw = text.split(" ", 2)
+        command = raw[0].lower()[1:]
+        args = raw[1:]
+        if command in self.__broadcast_commands:
+            workers = self.__workers
+        elif command in self.__local_commands or len(args) == 0:
+            # ~help and ~search give the same answer from any worker, the rest applies to every player
+            workers = self.__workers[:1] if command in self.__local_commands else self.__workers
+        else:
+            with self.__lock:
+                owner = self.__owners.get(args[0])
+            if owner is None:
+                self.__logger.error(self.__lang.lang("bot.player.not_found").format(username=args[0]))
+                return
+            workers = [owner]
+        self.__send(workers, ("text", text))
+
+    def stop(self):
+        self.__send(self.__workers, ("stop",))
+        for worker in self.__workers:
+            worker.process.join(timeout=10)
+
+    def start_listening(self):
+        while True:
+            try:
+                text = input("")
+                self.handle_text(text)
+            except KeyboardInterrupt:
+                self.__logger.info(self.__lang.lang("bot.end"))
+                self.stop()
+                exit()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import abc
+import argparse
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List, Optional
+
+
+class ChatSink(abc.ABC):
+    """
+    Forwards chat records to another system in batches from its own thread. A batch is sent once it has
+    batch_size records or its first record waited batch_seconds. A failed batch is retried with a growing
+    delay, up to max_retries times, then dropped. Meanwhile new records wait in a queue of capacity records,
+    and anything past that is dropped, so a slow or unreachable sink never blocks the chat path.
+    """
+
+    kind = "sink"
+    __max_retry_delay = 60.0
+
+    def __init__(self, name: str, options: dict):
+        self.__logger = logging.getLogger("Sink")
+        logging.basicConfig(level=logging.INFO)
+        self.name = name
+        self.__batch_size = max(int(options["batch_size"]), 1)
+        self.__batch_seconds = float(options["batch_seconds"])
+        self.__retry_interval = float(options["retry_interval"])
+        self.__max_retries = int(options["max_retries"])
+        # Queue(0) would be unbounded and take away the backpressure
+        self.__queue = queue.Queue(max(int(options["capacity"]), 1))
+        self.delivered = 0
+        self.dropped = 0
+        self.failures = 0
+        self.__oldest = None  # type: Optional[float]
+        self.__thread = threading.Thread(target=self.__run, name="Sink-{0}".format(name), daemon=True)
+        self.__thread.start()
+
+    @property
+    def backlog(self) -> int:
+        return self.__queue.qsize()
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest record not yet delivered has been waiting, 0 when caught up."""
+        oldest = self.__oldest
+        return time.time() - oldest if oldest is not None else 0.0
+
+    def submit(self, record: dict):
+        try:
+            self.__queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    @abc.abstractmethod
+    def deliver(self, batch: List[dict]):
+        """Send a batch, raising any exception when it didn't get through."""
+
+    def close(self):
+        pass
+
+    def __collect(self) -> List[dict]:
+        batch = [self.__queue.get()]
+        self.__oldest = batch[0]["time"]
+        deadline = time.monotonic() + self.__batch_seconds
+        while len(batch) < self.__batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.__queue.get(timeout=remaining) if remaining > 0 else self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __run(self):
+        while True:
+            batch = self.__collect()
+            attempt = 0
+            while True:
+                try:
+                    self.deliver(batch)
+                except Exception as e:
+                    # Anything deliver raises, http.client.HTTPException included, must not end this thread
+                    self.failures += 1
+                    if attempt >= self.__max_retries:
+                        self.dropped += len(batch)
+                        self.__logger.error("Sink {name} dropped {count} records after {attempts} attempts: "
+                                            "{error}".format(name=self.name, count=len(batch), attempts=attempt + 1,
+                                                             error=str(e)))
+                        break
+                    time.sleep(min(self.__retry_interval * 2 ** attempt, self.__max_retry_delay))
+                    attempt += 1
+                    continue
+                self.delivered += len(batch)
+                break
+            self.__oldest = None
+
+
+class JsonLinesSink(ChatSink):
+    """
+    Appends records to a JSON lines file. Each batch is one write, so workers sharing the file in sharded
+    mode don't interleave lines.
+    """
+
+    kind = "jsonl"
+
+    def __init__(self, name: str, options: dict):
+        self.__path = options["path"]
+        ChatSink.__init__(self, name, options)
+
+    def deliver(self, batch: List[dict]):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+        with open(self.__path, "ab") as fs:
+            fs.write(data)
+
+
+class SocketSink(ChatSink):
+    """Streams records as JSON lines to a unix socket path, or to host:port over TCP, reconnecting on failure."""
+
+    kind = "socket"
+
+    def __init__(self, name: str, options: dict):
+        self.__path = options.get("path")
+        self.__address = (options.get("host", "127.0.0.1"), int(options.get("port", 0)))
+        self.__timeout = float(options.get("timeout", 10.0))
+        self.__socket = None  # type: Optional[socket.socket]
+        ChatSink.__init__(self, name, options)
+
+    def __connect(self) -> socket.socket:
+        if self.__path:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.__timeout)
+            try:
+                connection.connect(self.__path)
+            except OSError:
+                connection.close()
+                raise
+            return connection
+        return socket.create_connection(self.__address, timeout=self.__timeout)
+
+    def deliver(self, batch: List[dict]):
+        if self.__socket is None:
+            self.__socket = self.__connect()
+        try:
+            self.__socket.sendall("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch)
+                                  .encode("utf-8"))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+
+class WebhookSink(ChatSink):
+    """POSTs each batch to url as a JSON array; any status outside 2xx counts as a failure and is retried."""
+
+    kind = "webhook"
+
+    def __init__(self, name: str, options: dict):
+        self.__url = options["url"]
+        self.__timeout = float(options.get("timeout", 10.0))
+        self.__headers = {"Content-Type": "application/json; charset=utf-8"}
+        self.__headers.update(options.get("headers", {}))
+        ChatSink.__init__(self, name, options)
+
+    def deliver(self, batch: List[dict]):
+        request = urllib.request.Request(self.__url, data=json.dumps(batch, ensure_ascii=False).encode("utf-8"),
+                                         headers=self.__headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.__timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            # HTTPError is an OSError too, this only adds the status to the message
+            raise OSError("{0} returned {1} {2}".format(self.__url, e.code, e.reason))
+
+
+_KINDS = {kind.kind: kind for kind in (JsonLinesSink, SocketSink, WebhookSink)}
+
+
+class ChatSinks:
+    """The sinks chat is fanned out to. publish only enqueues, so it's safe on the packet listener threads."""
+
+    def __init__(self, sinks: List[ChatSink]):
+        self.sinks = sinks
+
+    @staticmethod
+    def from_config(options: dict) -> "ChatSinks":
+        """Build the sinks listed in the sinks section; each output may override the section's batch settings."""
+        logger = logging.getLogger("Sink")
+        sinks = []
+        for index, output in enumerate(options["outputs"]):
+            settings = {key: value for key, value in options.items() if key != "outputs"}
+            settings.update(output)
+            kind = _KINDS.get(settings.get("type"))
+            if kind is None:
+                logger.error("Unknown sink type {0!r}, expected one of: {1}".format(
+                    settings.get("type"), ", ".join(sorted(_KINDS))))
+                continue
+            sinks.append(kind(settings.get("name", "{0}-{1}".format(kind.kind, index)), settings))
+        return ChatSinks(sinks)
+
+    def publish(self, timestamp: float, bots: List[str], position: str, json_data: str, text: str):
+        if len(self.sinks) == 0:
+            return
+        record = {
+            "time": timestamp,
+            "bots": bots,
+            "position": position,
+            "json": json_data,
+            "text": text
+        }
+        for sink in self.sinks:
+            sink.submit(record)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for chat sinks: print what a webhook or socket "
+                                                 "sink sends")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--webhook-port", type=int, help="accept webhook POSTs on this port")
+    parser.add_argument("--socket-port", type=int, help="accept socket sink connections on this TCP port")
+    parser.add_argument("--fail", type=int, default=0, metavar="N",
+                        help="answer the first N webhook requests with 503, to watch the sink retry")
+    args = parser.parse_args()
+    lock = threading.Lock()
+    failures = [args.fail]
+
+    def show(record: dict):
+        with lock:
+            print(json.dumps(record, ensure_ascii=False))
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                failing = failures[0] > 0
+                failures[0] -= 1
+            if failing:
+                self.send_error(503)
+                return
+            for record in json.loads(body.decode("utf-8")):
+                show(record)
+            self.send_response(204)
+            self.end_headers()
+
+        # noinspection PyShadowingBuiltins
+        def log_message(self, format, *args):
+            pass
+
+    class SocketHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                show(json.loads(line.decode("utf-8")))
+
+    servers = []
+    if args.webhook_port is not None:
+        servers.append(_ThreadingHTTPServer((args.host, args.webhook_port), WebhookHandler))
+    if args.socket_port is not None:
+        servers.append(_ThreadingTCPServer((args.host, args.socket_port), SocketHandler))
+    if len(servers) == 0:
+        parser.error("nothing to listen on, give --webhook-port and/or --socket-port")
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from archive import ChatArchive
+from capture import PacketCapture
+from chat import ChatAggregator
+from config import Config, ConfigError
+from events import HealthEvents
+from jobs import JobRunner
+from lang import Lang, LangRegistry
+from metrics import MetricsServer, prometheus_text
+from player import Player
+from ratelimit import TokenBucket
+from reconnect import ReconnectGate
+from scheduler import Scheduler
+from sinks import ChatSinks
+from tokens import SessionRefresher, TokenStore
+from tracing import StartupTracer, traced
+
+
+class Startup:
+    def __init__(self,
+                 config: Config,
+                 lang: Lang,
+                 token_store: TokenStore,
+                 scheduler: Scheduler,
+                 archive: Optional[ChatArchive] = None,
+                 capture: Optional[PacketCapture] = None,
+                 locales: Optional[LangRegistry] = None,
+                 tracer: Optional[StartupTracer] = None,
+                 sinks: Optional[ChatSinks] = None,
+                 session_refresher: Optional[SessionRefresher] = None):
+        self.__logger = logging.getLogger("Startup")
+        logging.basicConfig(level=logging.INFO)
+        self.__config = config
+        self.__lang = lang
+        self.__locales = locales if locales is not None else LangRegistry([lang])
+        self.__token_store = token_store
+        self.__scheduler = scheduler
+        self.__capture = capture
+        self.__tracer = tracer
+        self.__session_refresher = session_refresher
+        self.__chat_aggregator = ChatAggregator(lang, float(config.chat["dedup_window"]), archive, sinks)
+        self.__health_events = HealthEvents(lang, scheduler, config.health)
+        self.__reconnect_gate = ReconnectGate(config.server["ip"], config.server["port"], config.reconnect, scheduler)
+        self.__concurrency = max(int(config.startup["concurrency"]), 1)
+        self.__login_limit = TokenBucket(float(config.startup["logins_per_second"]))
+        self.__global_chat_limit = TokenBucket(
+            float(config.outbound["global_messages_per_second"]),
+            float(config.outbound["global_burst"])
+        )
+
+    def use_config(self, config: Config):
+        """Start later players with a reloaded config; the reconnect probe follows a server change."""
+        self.__config = config
+        self.__reconnect_gate.retarget(config.server["ip"], config.server["port"])
+
+    def __start_player(self, account: dict) -> Optional[Player]:
+        if self.__tracer is None:
+            return self.__create_player(account)
+        with self.__tracer.profiled(), self.__tracer.span("start", "account", email=account["email"]):
+            return self.__create_player(account)
+
+    def __create_player(self, account: dict) -> Optional[Player]:
+        session_ttl = float(self.__config.session["validation_ttl"])
+        # Paces every account, cached session or not, since each one also joins the server
+        with traced(self.__tracer, "login wait", "account", email=account["email"]):
+            self.__login_limit.acquire()
+        start = time.monotonic()
+        try:
+            player = Player(
+                account=account["email"],
+                password=account["password"],
+                server_address=self.__config.server["ip"],
+                port=self.__config.server["port"],
+                version=498,
+                auto_reconnect=self.__config.auto_reconnect,
+                auto_respawn=self.__config.auto_respawn,
+                # Without a lang of its own an account follows the fleet's, which a reload doesn't change
+                lang=self.__locales.get(account.get("lang", self.__lang.lang_name)),
+                token_store=self.__token_store,
+                outbound=self.__config.outbound,
+                scheduler=self.__scheduler,
+                reconnect_gate=self.__reconnect_gate,
+                chat_aggregator=self.__chat_aggregator,
+                global_chat_limit=self.__global_chat_limit,
+                capture=self.__capture,
+                chat_only=account.get("chat_only", self.__config.chat_only),
+                session_ttl=session_ttl,
+                health_events=self.__health_events,
+                tracer=self.__tracer,
+                session_refresher=self.__session_refresher
+            )
+        except Exception as e:
+            self.__logger.error(self.__lang.lang("main.startup.account.failed").format(
+                email=account["email"],
+                time="{0:.2f}".format(time.monotonic() - start),
+                message=str(e)
+            ))
+            return None
+        self.__logger.info(self.__lang.lang("main.startup.account.done").format(
+            email=account["email"],
+            time="{0:.2f}".format(time.monotonic() - start),
+            status=self.__lang.lang("main.startup.status.ok" if player.authenticated else "main.startup.status.failed")
+        ))
+        return player
+
+    def start(self, accounts: Optional[List[dict]] = None) -> List[Player]:
+        """Authenticate and connect every enabled account (default: all in config), returning players in order."""
+        enabled = []
+        for account in self.__config.accounts if accounts is None else accounts:
+            if account["disabled"]:
+                self.__logger.info(self.__lang.lang("main.auth.disabled").format(email=account["email"]))
+                continue
+            enabled.append(account)
+        accounts = enabled
+
+        self.__logger.info(self.__lang.lang("main.startup.begin").format(
+            count=len(accounts),
+            concurrency=self.__concurrency
+        ))
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.__concurrency, thread_name_prefix="Startup") as executor:
+            results = list(executor.map(self.__start_player, accounts))
+
+        players = [player for player in results if player is not None]
+        authenticated = len([player for player in players if player.authenticated])
+        self.__logger.info(self.__lang.lang("main.startup.summary").format(
+            ok=authenticated,
+            total=len(accounts),
+            failed=len(accounts) - authenticated,
+            time="{0:.2f}".format(time.monotonic() - start)
+        ))
+        return players
+
+
+class FleetReloader:
+    """
+    Reconciles running players with config.json after it changes. Added or re-enabled accounts are
+    started, removed or disabled ones disconnected, accounts whose settings changed are restarted, and new
+    auto_reconnect/auto_respawn values are applied to the players left running.
+    """
+
+    def __init__(self,
+                 startup: Startup,
+                 config: Config,
+                 lang: Lang,
+                 players: List[Player],
+                 scheduler: Scheduler,
+                 owns: Optional[Callable[[dict], bool]] = None,
+                 on_change: Optional[Callable[[], None]] = None):
+        self.__logger = logging.getLogger("Reload")
+        logging.basicConfig(level=logging.INFO)
+        self.__startup = startup
+        self.__config = config
+        self.__lang = lang
+        self.__players = players
+        self.__scheduler = scheduler
+        self.__owns = owns
+        self.__on_change = on_change
+        self.__lock = threading.Lock()
+        self.__accounts = self.__wanted(config)
+        self.__mtime = self.__stat()
+        self.__interval = float(config.reload["interval"])
+        if self.__interval > 0:
+            self.__scheduler.schedule(self.__interval, self.__poll)
+
+    @staticmethod
+    def __stat() -> Optional[int]:
+        try:
+            return os.stat(Config.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def __poll(self):
+        try:
+            mtime = self.__stat()
+            if mtime is not None and mtime != self.__mtime and not self.__lock.locked():
+                # Starting players blocks on logins and connects, keep that off the scheduler's workers
+                threading.Thread(target=self.reload, name="Reload", daemon=True).start()
+        finally:
+            self.__scheduler.schedule(self.__interval, self.__poll)
+
+    def __wanted(self, config: Config) -> Dict[str, Tuple[dict, tuple]]:
+        """Enabled accounts this process runs, each with the settings that need a restart when they change."""
+        wanted = {}
+        for account in config.accounts:
+            if account["disabled"] or (self.__owns is not None and not self.__owns(account)):
+                continue
+            wanted[account["email"]] = (account, (
+                account["password"],
+                account.get("lang"),
+                account.get("chat_only", config.chat_only),
+                config.server["ip"],
+                config.server["port"]
+            ))
+        return wanted
+
+    def reload(self):
+        with self.__lock:
+            self.__mtime = self.__stat()
+            try:
+                config = Config(reloading=True)
+            except ConfigError:
+                return
+            old = self.__config
+            if config.lang != old.lang:
+                self.__logger.warning(self.__lang.lang("main.reload.restart_needed").format(setting="lang"))
+
+            wanted = self.__wanted(config)
+            stop = [email for email, (_, settings) in self.__accounts.items()
+                    if email not in wanted or wanted[email][1] != settings]
+            start = [account for email, (account, _) in wanted.items()
+                     if email not in self.__accounts or email in stop]
+
+            kept = []
+            for player in list(self.__players):
+                if player.email not in stop:
+                    kept.append(player)
+                elif player.authenticated:
+                    player.disconnect()
+            for player in kept:
+                if not player.authenticated:
+                    continue
+                if config.auto_reconnect != old.auto_reconnect:
+                    player.set_auto_reconnect(config.auto_reconnect)
+                if config.auto_respawn != old.auto_respawn:
+                    player.set_auto_respawn(config.auto_respawn)
+
+            self.__config = config
+            self.__accounts = wanted
+            self.__startup.use_config(config)
+            started = self.__startup.start(start) if len(start) > 0 else []
+            # The chat bot, jobs, refresher and metrics read this list from other threads; one slice
+            # assignment swaps its contents at once, so they see the fleet before or after, never halfway
+            self.__players[:] = kept + started
+            self.__logger.info(self.__lang.lang("main.reload.done").format(
+                started=len([account for account in start if account["email"] not in stop]),
+                stopped=len([email for email in stop if email not in wanted]),
+                restarted=len([email for email in stop if email in wanted])
+            ))
+        if self.__on_change is not None:
+            self.__on_change()
+
+
+class Fleet:
+    """What start_fleet built for one process, handed on to the ChatBot."""
+
+    def __init__(self,
+                 players: List[Player],
+                 archive: Optional[ChatArchive],
+                 reloader: FleetReloader,
+                 jobs: JobRunner,
+                 sinks: ChatSinks):
+        self.players = players
+        self.archive = archive
+        self.reloader = reloader
+        self.jobs = jobs
+        self.sinks = sinks
+
+
+def start_fleet(config: Config,
+                lang: Lang,
+                owns: Optional[Callable[[dict], bool]] = None,
+                capture_path: Optional[str] = None,
+                metrics_port: Optional[int] = None,
+                on_change: Optional[Callable[[], None]] = None,
+                locales: Optional[LangRegistry] = None,
+                tracer: Optional[StartupTracer] = None) -> Fleet:
+    """Build the shared services for one process and start its players (those owns accepts, default all)."""
+    with traced(tracer, "services"):
+        token_store = TokenStore()
+        scheduler = Scheduler()
+        archive = None
+        if config.archive["enabled"]:
+            archive = ChatArchive(
+                folder=config.archive["folder"],
+                segment_records=int(config.archive["segment_records"]),
+                segment_seconds=float(config.archive["segment_seconds"])
+            )
+        capture = PacketCapture(capture_path) if capture_path else None
+        sinks = ChatSinks.from_config(config.sinks)
+        # Players hand expired sessions to the refresher, so it exists before them and watches the list they fill
+        players = []  # type: List[Player]
+        refresher = SessionRefresher(players, token_store, scheduler, config.session)
+        startup = Startup(config, lang, token_store, scheduler, archive, capture, locales, tracer, sinks, refresher)
+    accounts = [account for account in config.accounts if owns is None or owns(account)]
+    with traced(tracer, "accounts"):
+        players[:] = startup.start(accounts)
+    with traced(tracer, "background services"):
+        reloader = FleetReloader(startup, config, lang, players, scheduler, owns, on_change)
+        if config.metrics["http_enabled"]:
+            MetricsServer(
+                host=config.metrics["host"],
+                port=int(config.metrics["port"]) if metrics_port is None else metrics_port,
+                render=lambda: prometheus_text(list(players), lang.render_timing, sinks.sinks)
+            )
+        jobs = JobRunner(players, lang, scheduler, config.jobs)
+    return Fleet(players, archive, reloader, jobs, sinks)
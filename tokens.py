@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from ratelimit import TokenBucket
+from scheduler import ScheduledTask, Scheduler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class _FileLock:
+    """An exclusive lock on a file shared with other processes, a no-op where fcntl is unavailable."""
+
+    def __init__(self, path: str):
+        self.__path = path
+        self.__fs = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.__fs = open(self.__path, "a")
+            fcntl.flock(self.__fs.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__fs is not None:
+            fcntl.flock(self.__fs.fileno(), fcntl.LOCK_UN)
+            self.__fs.close()
+            self.__fs = None
+
+
+class TokenStore:
+    """
+    Session tokens for every account, loaded once and written back atomically in coalesced batches.
+    Only entries changed here are merged into the file, so processes sharing it keep each other's tokens.
+    Each entry also records the profile and when the auth server last accepted the token.
+    """
+
+    def __init__(self, path: str = "./data.json", flush_delay: float = 1.0):
+        self.__logger = logging.getLogger("TokenStore")
+        logging.basicConfig(level=logging.INFO)
+        self.__path = path
+        self.__flush_delay = flush_delay
+        self.__lock = threading.Lock()
+        self.__write_lock = threading.Lock()
+        self.__dirty = threading.Event()
+        self.__changed = set()
+        self.__tokens = self.__load()
+        self.__writer = threading.Thread(target=self.__write_loop, name="TokenStore", daemon=True)
+        self.__writer.start()
+        atexit.register(self.flush)
+
+    def __load(self) -> dict:
+        try:
+            with open(self.__path, 'r') as fs:
+                return json.load(fs)
+        except FileNotFoundError:
+            return {}
+        except json.decoder.JSONDecodeError as e:
+            self.__logger.error("Can't load {path}, all accounts will log in again: {error}".format(
+                path=self.__path, error=str(e)))
+            return {}
+
+    def get(self, email: str) -> dict:
+        with self.__lock:
+            if email in self.__tokens:
+                return dict(self.__tokens[email])
+        return {
+            "access": None,
+            "client": None
+        }
+
+    def update(self, email: str, access: str, client: str, profile: Optional[dict] = None):
+        """Store tokens the auth server just accepted, restarting their validation TTL."""
+        with self.__lock:
+            self.__tokens[email] = {
+                "access": access,
+                "client": client,
+                "profile": profile,
+                "validated": time.time()
+            }
+            self.__changed.add(email)
+            self.__dirty.set()
+
+    def age(self, email: str) -> Optional[float]:
+        """Seconds since the tokens were last validated, None if that is unknown."""
+        with self.__lock:
+            validated = self.__tokens.get(email, {}).get("validated")
+        if not validated:
+            return None
+        return max(time.time() - validated, 0.0)
+
+    def fresh(self, email: str, ttl: float) -> bool:
+        """Whether the tokens and profile can be used without asking the auth server again."""
+        with self.__lock:
+            profile = self.__tokens.get(email, {}).get("profile")
+        age = self.age(email)
+        return ttl > 0 and bool(profile) and age is not None and age < ttl
+
+    def invalidate(self, email: str):
+        """Forget when the tokens were validated, after a server rejected them."""
+        with self.__lock:
+            if self.__tokens.get(email, {}).get("validated"):
+                self.__tokens[email]["validated"] = 0
+                self.__changed.add(email)
+                self.__dirty.set()
+
+    def __write_loop(self):
+        while True:
+            self.__dirty.wait()
+            # Let refreshes that land close together share one write
+            time.sleep(self.__flush_delay)
+            self.flush()
+
+    def flush(self):
+        with self.__write_lock:
+            with self.__lock:
+                if not self.__dirty.is_set():
+                    return
+                self.__dirty.clear()
+                changed = {email: dict(self.__tokens[email]) for email in self.__changed}
+                self.__changed = set()
+            tmp_path = "{path}.{pid}.tmp".format(path=self.__path, pid=os.getpid())
+            try:
+                with _FileLock(self.__path + ".lock"):
+                    tokens = self.__load()
+                    tokens.update(changed)
+                    with open(tmp_path, 'w') as fs:
+                        fs.write(json.dumps(tokens, indent=2))
+                        fs.flush()
+                        os.fsync(fs.fileno())
+                    os.replace(tmp_path, self.__path)
+            except OSError as e:
+                self.__logger.error("Can't save {path}: {error}".format(path=self.__path, error=str(e)))
+                with self.__lock:
+                    self.__changed.update(changed)
+                    self.__dirty.set()
+
+
+class SessionRefresher:
+    """
+    Renews sessions in the background once their last validation is older than refresh_age, each at a
+    random point within refresh_spread seconds, so restarts find fresh tokens and a fleet never refreshes
+    in one burst. An account whose refresh fails is retried with a doubling delay instead of every check.
+    Trips to the auth server are limited to auth_per_second; one over the limit is put off, not waited for.
+    Players are duck-typed: email, authenticated and refresh_session() are all it uses.
+    """
+
+    __max_backoff = 3600.0
+
+    def __init__(self, players: List, token_store: TokenStore, scheduler: Scheduler, options: dict):
+        self.__players = players
+        self.__token_store = token_store
+        self.__scheduler = scheduler
+        self.__refresh_age = float(options["refresh_age"])
+        self.__spread = max(float(options["refresh_spread"]), 0.0)
+        self.__interval = float(options["check_interval"])
+        self.__auth_limit = TokenBucket(float(options["auth_per_second"]))
+        self.__lock = threading.Lock()
+        self.__pending = set()
+        self.__tasks = {}  # type: Dict[str, ScheduledTask]
+        self.__tickets = {}  # type: Dict[str, object]
+        self.__callbacks = {}  # type: Dict[str, List[Callable[[], None]]]
+        self.__failures = {}  # type: Dict[str, int]
+        self.__retry_at = {}  # type: Dict[str, float]
+        if self.__refresh_age > 0 and self.__interval > 0:
+            self.__scheduler.schedule(self.__interval, self.__check)
+
+    def __check(self):
+        try:
+            now = time.monotonic()
+            for player in list(self.__players):
+                if not player.authenticated:
+                    continue
+                age = self.__token_store.age(player.email)
+                if age is not None and age < self.__refresh_age:
+                    continue
+                with self.__lock:
+                    if self.__retry_at.get(player.email, 0.0) > now:
+                        continue
+                self.request(player, random.uniform(0, self.__spread))
+        finally:
+            self.__scheduler.schedule(self.__interval, self.__check)
+
+    def request(self, player, delay: float = 0.0, then: Optional[Callable[[], None]] = None):
+        """
+        Refresh player's session after delay, or sooner if one is already waiting for it; never two at
+        once for the same account. then runs after that refresh, whether or not it worked.
+        """
+        with self.__lock:
+            if then is not None:
+                self.__callbacks.setdefault(player.email, []).append(then)
+            if player.email in self.__pending:
+                task = self.__tasks.get(player.email)
+                if task is None or task.when <= time.monotonic() + delay:
+                    # Already running, or due sooner anyway
+                    return
+                task.cancel()
+            self.__pending.add(player.email)
+            # A cancelled task may already be on a worker; only the latest ticket gets to refresh
+            ticket = object()
+            self.__tickets[player.email] = ticket
+            self.__tasks[player.email] = self.__scheduler.schedule(delay, self.__refresh, player, ticket)
+
+    def __refresh(self, player, ticket: object):
+        with self.__lock:
+            if self.__tickets.get(player.email) is not ticket:
+                return
+            if not self.__auth_limit.try_acquire():
+                # Waiting for a token here would hold a scheduler worker that reconnects and chat need too
+                self.__tasks[player.email] = self.__scheduler.schedule(
+                    self.__auth_limit.delay(), self.__refresh, player, ticket)
+                return
+            del self.__tickets[player.email]
+            self.__tasks.pop(player.email, None)
+        try:
+            player.refresh_session()
+        finally:
+            age = self.__token_store.age(player.email)
+            with self.__lock:
+                self.__pending.discard(player.email)
+                callbacks = self.__callbacks.pop(player.email, [])
+                if age is not None and age < self.__refresh_age:
+                    self.__failures.pop(player.email, None)
+                    self.__retry_at.pop(player.email, None)
+                else:
+                    failures = self.__failures.get(player.email, 0) + 1
+                    self.__failures[player.email] = failures
+                    self.__retry_at[player.email] = time.monotonic() + min(
+                        self.__interval * 2 ** failures, self.__max_backoff)
+            for callback in callbacks:
+                callback()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+Span = namedtuple("Span", ["name", "category", "start", "end", "thread", "args"])
+
+
+class StartupTracer:
+    """
+    Records spans for each startup phase and each account: imports, Logger, Config, Lang, then per account
+    auth(), Connection.connect() and the wait for the first JoinGamePacket. Spans that end on another
+    thread, like the join, are opened with begin and closed with end. With profile set, profiled blocks
+    also run under cProfile, merged when the profile is written. Before Python 3.12 that is one profiler
+    per thread; from 3.12 a profiler sees every thread, so the first one enabled covers the rest.
+    """
+
+    __join_timeout = 60.0
+    __summary_accounts = 5
+    __summary_functions = 25
+
+    def __init__(self, profile: bool = False):
+        self.__logger = logging.getLogger("Trace")
+        self.__origin = time.perf_counter()
+        self.__lock = threading.Lock()
+        self.__done = threading.Condition(self.__lock)
+        self.__spans = []  # type: List[Span]
+        self.__open = {}  # type: Dict[tuple, tuple]
+        self.__threads = {}  # type: Dict[int, str]
+        self.__profile = profile
+        self.__profilers = []  # type: List[cProfile.Profile]
+        self.__profiling = threading.local()
+        self.__closed = False
+
+    def __now(self) -> float:
+        return time.perf_counter() - self.__origin
+
+    def __record(self, name: str, category: str, start: float, end: float, args: dict):
+        thread = threading.current_thread()
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__threads[thread.ident] = thread.name
+            self.__spans.append(Span(name, category, start, end, thread.ident, args))
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **args):
+        start = self.__now()
+        try:
+            yield
+        finally:
+            self.__record(name, category, start, self.__now(), args)
+
+    def begin(self, key: tuple, name: str, category: str = "account", **args):
+        with self.__lock:
+            if not self.__closed:
+                self.__open[key] = (name, category, self.__now(), args)
+
+    def end(self, key: tuple, **args) -> bool:
+        """Close a span opened with begin, from any thread; False when it isn't open."""
+        with self.__lock:
+            opened = self.__open.pop(key, None)
+            if opened is None or self.__closed:
+                return False
+            name, category, start, begin_args = opened
+            thread = threading.current_thread()
+            self.__threads[thread.ident] = thread.name
+            self.__spans.append(Span(name, category, start, self.__now(), thread.ident, dict(begin_args, **args)))
+            if len(self.__open) == 0:
+                self.__done.notify_all()
+        return True
+
+    def wait(self, timeout: float) -> int:
+        """Wait for the spans opened with begin to end, returning how many are still open after timeout."""
+        deadline = time.monotonic() + timeout
+        with self.__lock:
+            while len(self.__open) > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.__done.wait(remaining)
+            return len(self.__open)
+
+    @contextmanager
+    def profiled(self):
+        if not self.__profile or self.__closed or getattr(self.__profiling, "active", False):
+            # Nested in a profiled block of this thread, which already covers it. Before 3.12 a second
+            # enable here would silently take the thread over from the outer profiler
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            if sys.version_info < (3, 12):
+                raise
+            # Python 3.12+ has one profiler per process, and the one already running sees every thread
+            yield
+            return
+        self.__profiling.active = True
+        try:
+            yield
+        finally:
+            self.__profiling.active = False
+            profiler.disable()
+            with self.__lock:
+                self.__profilers.append(profiler)
+
+    @property
+    def spans(self) -> List[Span]:
+        with self.__lock:
+            return sorted(self.__spans, key=lambda span: span.start)
+
+    def summary(self) -> List[str]:
+        spans = self.spans
+        lines = ["Startup trace, {0:.3f}s in total:".format(max((span.end for span in spans), default=0.0))]
+        for span in spans:
+            if span.category == "phase":
+                lines.append("  {0:>8.3f}s +{1:.3f}s  {2}".format(span.start, span.end - span.start, span.name))
+        steps = {}  # type: Dict[str, List[float]]
+        accounts = {}  # type: Dict[str, float]
+        for span in spans:
+            if span.category == "account":
+                steps.setdefault(span.name, []).append(span.end - span.start)
+                email = span.args.get("email")
+                accounts[email] = max(accounts.get(email, 0.0), span.end)
+        for name, durations in steps.items():
+            durations.sort()
+            lines.append("  {0}: {1} accounts, min {2:.3f}s, median {3:.3f}s, max {4:.3f}s".format(
+                name, len(durations), durations[0], durations[len(durations) // 2], durations[-1]))
+        slowest = sorted(accounts.items(), key=lambda item: item[1], reverse=True)[:self.__summary_accounts]
+        if len(slowest) > 0:
+            lines.append("  last accounts ready: {0}".format(", ".join(
+                "{0} at {1:.3f}s".format(email, end) for email, end in slowest)))
+        with self.__lock:
+            still_open = sorted(set(opened[0] for opened in self.__open.values()))
+        if len(still_open) > 0:
+            lines.append("  still open: {0}".format(", ".join(still_open)))
+        return lines
+
+    def chrome_trace(self) -> dict:
+        """The spans as a Chrome trace, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        with self.__lock:
+            threads = dict(self.__threads)
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in threads.items()]
+        for span in self.spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": round(span.start * 1e6),
+                "dur": round((span.end - span.start) * 1e6),
+                "pid": pid,
+                "tid": span.thread,
+                "args": span.args
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as fs:
+            json.dump(self.chrome_trace(), fs, ensure_ascii=False)
+
+    def write_profile(self, path: str) -> Optional[pstats.Stats]:
+        with self.__lock:
+            profilers = list(self.__profilers)
+        if len(profilers) == 0:
+            return None
+        stats = pstats.Stats(profilers[0], stream=io.StringIO())
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path)
+        return stats
+
+    def report(self, trace_path: str, profile_path: Optional[str] = None):
+        """
+        Log the summary and write the Chrome trace, and the merged cProfile stats when profiling. Later spans,
+        like players started by a reload, are no longer recorded.
+        """
+        with self.__lock:
+            self.__closed = True
+        for line in self.summary():
+            self.__logger.info(line)
+        try:
+            self.write(trace_path)
+            self.__logger.info("Startup trace written to {0}".format(trace_path))
+            if profile_path is not None:
+                stats = self.write_profile(profile_path)
+                if stats is not None:
+                    stats.stream = io.StringIO()
+                    stats.sort_stats("cumulative").print_stats(self.__summary_functions)
+                    self.__logger.info("Startup profile written to {path} (python -m pstats {path}):\n{top}".format(
+                        path=profile_path, top=stats.stream.getvalue().strip()))
+        except OSError as e:
+            self.__logger.error("Can't write startup trace: {0}".format(str(e)))
+
+    def report_when_joined(self, trace_path: str, profile_path: Optional[str] = None):
+        """Report on a background thread once every account has joined, or after a minute."""
+
+        def run():
+            self.wait(self.__join_timeout)
+            self.report(trace_path, profile_path)
+
+        threading.Thread(target=run, name="Trace", daemon=True).start()
+
+
+@contextmanager
+def _untraced():
+    # contextlib.nullcontext needs Python 3.7
+    yield
+
+
+def traced(tracer: Optional[StartupTracer], name: str, category: str = "phase", **args):
+    """A span on tracer, or nothing when startup isn't being traced."""
+    if tracer is None:
+        return _untraced()
+    return tracer.span(name, category, **args)
+
+
+def profiled(tracer: Optional[StartupTracer]):
+    """tracer.profiled(), or nothing when startup isn't being traced."""
+    if tracer is None:
+        return _untraced()
+    return tracer.profiled()